@@ -103,11 +103,17 @@ module "ec2_dr" {
   dr_region          = var.dr_region
   instance_ids       = var.ec2_instance_ids
   kms_key_id         = var.kms_enabled ? aws_kms_key.dr_kms.arn : null
+  kms_key_id_dr      = var.kms_enabled ? aws_kms_key.dr_kms_dr.arn : null
   sns_topic_arn      = aws_sns_topic.dr_alerts.arn
   rpo_target_minutes = var.rpo_target
   environment        = var.environment
   project_name       = var.project_name
   tags               = local.common_tags
+
+  enable_change_detection       = var.ec2_change_detection
+  max_snapshot_interval_minutes = var.ec2_max_snapshot_interval
+  enable_delta_sizing           = var.ec2_delta_sizing
+  shard_size                    = var.ec2_snapshot_shard_size
 }
 
 module "rds_dr" {
@@ -236,10 +242,15 @@ module "lambda_failover" {
   dr_region       = var.dr_region
   sns_topic_arn   = aws_sns_topic.dr_alerts.arn
   kms_key_id      = var.kms_enabled ? aws_kms_key.dr_kms.arn : null
+  kms_key_id_dr   = var.kms_enabled ? aws_kms_key.dr_kms_dr.arn : null
   rto_target      = var.rto_target
   environment     = var.environment
   project_name    = var.project_name
   tags            = local.common_tags
+
+  enable_ec2_restore    = var.ec2_restore_on_failover
+  dr_subnet_id          = module.vpc_dr.private_subnet_ids[0]
+  dr_security_group_ids = [module.vpc_dr.default_security_group_id]
 }
 
 resource "aws_cloudwatch_event_rule" "dr_workflow" {
@@ -1,5 +1,12 @@
 locals {
   name_prefix = var.name_prefix
+
+  snapshot_timeout = 300
+
+  # Throttled shard invocations are dropped after this age, so a shard still unreported
+  # once it has passed (plus one run) is really lost and its run can be closed
+  shard_max_event_age = 1800
+  run_stale_seconds   = local.shard_max_event_age + local.snapshot_timeout + 300
 }
 
 resource "aws_iam_role" "ec2_snapshot_replication" {
@@ -62,8 +69,53 @@ resource "aws_cloudwatch_event_rule" "ec2_snapshot_schedule" {
 
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/snapshot_lambda.py"
   output_path = "${path.module}/snapshot_lambda.zip"
+
+  source {
+    content  = file("${path.module}/snapshot_lambda.py")
+    filename = "snapshot_lambda.py"
+  }
+
+  source {
+    content  = file("${path.module}/snapshot_delta.py")
+    filename = "snapshot_delta.py"
+  }
+
+  source {
+    content  = file("${path.module}/snapshot_shards.py")
+    filename = "snapshot_shards.py"
+  }
+}
+
+resource "aws_dynamodb_table" "snapshot_runs" {
+  name         = "${local.name_prefix}-ec2-snapshot-runs"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "run_id"
+  range_key    = "shard_id"
+
+  attribute {
+    name = "run_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "shard_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  server_side_encryption {
+    enabled     = true
+    kms_key_arn = var.kms_key_id
+  }
+
+  tags = merge(var.tags, {
+    Name = "${local.name_prefix}-ec2-snapshot-runs"
+  })
 }
 
 resource "aws_lambda_function" "ec2_snapshot" {
@@ -72,7 +124,7 @@ resource "aws_lambda_function" "ec2_snapshot" {
   role            = aws_iam_role.lambda_snapshot.arn
   handler         = "snapshot_lambda.handler"
   runtime         = "python3.12"
-  timeout         = 300
+  timeout         = local.snapshot_timeout
 
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
 
@@ -80,14 +132,29 @@ resource "aws_lambda_function" "ec2_snapshot" {
     variables = {
       INSTANCE_IDS     = join(",", var.instance_ids)
       DR_REGION        = var.dr_region
-      KMS_KEY_ID       = var.kms_key_id != null ? var.kms_key_id : ""
+      DR_KMS_KEY_ID    = var.kms_key_id_dr != null ? var.kms_key_id_dr : ""
       SNS_TOPIC_ARN    = var.sns_topic_arn
+      CHANGE_DETECTION = tostring(var.enable_change_detection)
+
+      MAX_SNAPSHOT_INTERVAL_MINUTES = var.max_snapshot_interval_minutes
+      DELTA_SIZING                  = tostring(var.enable_delta_sizing)
+      RPO_TARGET_MINUTES            = var.rpo_target_minutes
+      COPY_THROUGHPUT_MIBPS         = var.copy_throughput_mibps
+      SHARD_SIZE                    = var.shard_size
+      RUN_TABLE                     = aws_dynamodb_table.snapshot_runs.name
+      RUN_STALE_SECONDS             = local.run_stale_seconds
     }
   }
 
   tags = var.tags
 }
 
+resource "aws_lambda_function_event_invoke_config" "ec2_snapshot" {
+  function_name                = aws_lambda_function.ec2_snapshot.function_name
+  maximum_event_age_in_seconds = local.shard_max_event_age
+  maximum_retry_attempts       = 2
+}
+
 resource "aws_iam_role" "lambda_snapshot" {
   name = "${local.name_prefix}-lambda-snapshot-role"
 
@@ -135,14 +202,43 @@ resource "aws_iam_role_policy" "lambda_snapshot" {
         ]
         Resource = "*"
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "cloudwatch:GetMetricData",
+          "ebs:ListChangedBlocks"
+        ]
+        Resource = "*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:PutItem",
+          "dynamodb:GetItem",
+          "dynamodb:UpdateItem",
+          "dynamodb:DeleteItem",
+          "dynamodb:Query"
+        ]
+        Resource = aws_dynamodb_table.snapshot_runs.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = "arn:aws:lambda:*:*:function:${local.name_prefix}-ec2-snapshot"
+      },
       {
         Effect = "Allow"
         Action = [
           "kms:Decrypt",
           "kms:Encrypt",
-          "kms:CreateGrant"
+          "kms:CreateGrant",
+          "kms:DescribeKey",
+          "kms:GenerateDataKeyWithoutPlaintext",
+          "kms:ReEncrypt*"
         ]
-        Resource = var.kms_key_id != null ? [var.kms_key_id] : ["*"]
+        Resource = var.kms_key_id != null ? compact([var.kms_key_id, var.kms_key_id_dr]) : ["*"]
       },
       {
         Effect = "Allow"
@@ -3,6 +3,11 @@ output "snapshot_role_arn" {
   value       = aws_iam_role.ec2_snapshot_replication.arn
 }
 
+output "snapshot_runs_table_name" {
+  description = "DynamoDB table holding sharded snapshot run results"
+  value       = aws_dynamodb_table.snapshot_runs.name
+}
+
 output "snapshot_lambda_arn" {
   description = "EC2 snapshot Lambda ARN"
   value       = aws_lambda_function.ec2_snapshot.arn
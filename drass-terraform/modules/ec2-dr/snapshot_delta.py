@@ -0,0 +1,158 @@
+"""
+EBS Snapshot Delta Sizing
+Measures the changed bytes between consecutive DR snapshots of each volume
+with the EBS direct API and predicts cross-region copy time against the RPO.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+DEFAULT_THROUGHPUT_MIBPS = 25
+MAX_WORKERS = 8
+
+# Measured deltas are tagged onto the later snapshot so each pair is only sized once
+DELTA_FROM_TAG = 'DeltaFromSnapshotId'
+DELTA_BLOCKS_TAG = 'DeltaChangedBlocks'
+DELTA_BYTES_TAG = 'DeltaChangedBytes'
+
+def get_dr_snapshot_pairs(ec2_client, volume_ids=None):
+    filters = [
+        {'Name': 'tag:DR', 'Values': ['true']},
+        {'Name': 'status', 'Values': ['completed']}
+    ]
+    volume_batches = [volume_ids[i:i + 200] for i in range(0, len(volume_ids), 200)] if volume_ids else [None]
+
+    by_volume = {}
+    paginator = ec2_client.get_paginator('describe_snapshots')
+    for batch in volume_batches:
+        batch_filters = filters + [{'Name': 'volume-id', 'Values': batch}] if batch else filters
+        for page in paginator.paginate(Filters=batch_filters, OwnerIds=['self']):
+            for snapshot in page['Snapshots']:
+                by_volume.setdefault(snapshot['VolumeId'], []).append(snapshot)
+
+    pairs = {}
+    for volume_id, snapshots in by_volume.items():
+        snapshots.sort(key=lambda x: x['StartTime'])
+        previous = snapshots[-2] if len(snapshots) > 1 else None
+        pairs[volume_id] = (previous, snapshots[-1])
+
+    return pairs
+
+def count_changed_blocks(ebs_client, first_snapshot_id, second_snapshot_id):
+    # Without a first snapshot the API lists every written block of the second one
+    kwargs = {'SecondSnapshotId': second_snapshot_id, 'MaxResults': 10000}
+    if first_snapshot_id:
+        kwargs['FirstSnapshotId'] = first_snapshot_id
+
+    changed_blocks = 0
+    block_size = 0
+    while True:
+        page = ebs_client.list_changed_blocks(**kwargs)
+        changed_blocks += len(page.get('ChangedBlocks', []))
+        block_size = page.get('BlockSize', block_size)
+        if not page.get('NextToken'):
+            break
+        kwargs['NextToken'] = page['NextToken']
+
+    return changed_blocks, changed_blocks * block_size
+
+def observe_copy_throughput(dr_ec2_client, deltas):
+    # In-flight DR copies of a measured snapshot give bytes copied so far over elapsed time
+    source_ids = [delta['snapshot_id'] for delta in deltas if 'changed_bytes' in delta]
+    changed_bytes = {delta['snapshot_id']: delta['changed_bytes'] for delta in deltas if 'changed_bytes' in delta}
+    now = datetime.now(timezone.utc)
+
+    observations = []
+    paginator = dr_ec2_client.get_paginator('describe_snapshots')
+    for i in range(0, len(source_ids), 200):
+        pages = paginator.paginate(
+            Filters=[
+                {'Name': 'tag:SourceSnapshotId', 'Values': source_ids[i:i + 200]},
+                {'Name': 'status', 'Values': ['pending']}
+            ],
+            OwnerIds=['self']
+        )
+        for page in pages:
+            for copy in page['Snapshots']:
+                tags = {tag['Key']: tag['Value'] for tag in copy.get('Tags', [])}
+                progress = float(copy.get('Progress', '0%').rstrip('%') or 0)
+                elapsed = (now - copy['StartTime']).total_seconds()
+                copied = changed_bytes.get(tags.get('SourceSnapshotId'), 0) * progress / 100
+                if copied > 0 and elapsed > 0:
+                    observations.append(copied / elapsed)
+
+    if not observations:
+        return None
+    observations.sort()
+    return observations[len(observations) // 2]
+
+def get_recorded_delta(snapshot, previous_snapshot_id):
+    tags = {tag['Key']: tag['Value'] for tag in snapshot.get('Tags', [])}
+    if DELTA_BYTES_TAG not in tags or tags.get(DELTA_FROM_TAG) != (previous_snapshot_id or 'none'):
+        return None
+    return int(tags[DELTA_BLOCKS_TAG]), int(tags[DELTA_BYTES_TAG])
+
+def record_delta(ec2_client, delta):
+    ec2_client.create_tags(
+        Resources=[delta['snapshot_id']],
+        Tags=[
+            {'Key': DELTA_FROM_TAG, 'Value': delta['previous_snapshot_id'] or 'none'},
+            {'Key': DELTA_BLOCKS_TAG, 'Value': str(delta['changed_blocks'])},
+            {'Key': DELTA_BYTES_TAG, 'Value': str(delta['changed_bytes'])}
+        ]
+    )
+
+def estimate_snapshot_deltas(ec2_client, ebs_client, dr_ec2_client, rpo_minutes,
+                             volume_ids=None, default_throughput_mibps=DEFAULT_THROUGHPUT_MIBPS,
+                             record=False):
+    pairs = get_dr_snapshot_pairs(ec2_client, volume_ids)
+
+    def measure(volume_id):
+        previous, latest = pairs[volume_id]
+        delta = {
+            'volume_id': volume_id,
+            'snapshot_id': latest['SnapshotId'],
+            'previous_snapshot_id': previous['SnapshotId'] if previous else None
+        }
+        recorded = get_recorded_delta(latest, delta['previous_snapshot_id'])
+        if recorded:
+            delta['changed_blocks'], delta['changed_bytes'] = recorded
+            delta['recorded'] = True
+            return delta
+        try:
+            blocks, size = count_changed_blocks(ebs_client, delta['previous_snapshot_id'], delta['snapshot_id'])
+            delta['changed_blocks'] = blocks
+            delta['changed_bytes'] = size
+        except Exception as e:
+            delta['error'] = str(e)
+            return delta
+        if record:
+            try:
+                record_delta(ec2_client, delta)
+            except Exception as e:
+                # An unrecorded delta is only re-measured next time
+                print(f"Could not record delta for {delta['snapshot_id']}: {str(e)}")
+        return delta
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        deltas = list(executor.map(measure, sorted(pairs)))
+
+    throughput = None
+    if dr_ec2_client is not None:
+        try:
+            throughput = observe_copy_throughput(dr_ec2_client, deltas)
+        except Exception:
+            throughput = None
+    throughput_source = 'observed' if throughput else 'default'
+    throughput = throughput or default_throughput_mibps * 1024 * 1024
+
+    for delta in deltas:
+        if 'changed_bytes' in delta:
+            delta['predicted_copy_seconds'] = delta['changed_bytes'] / throughput
+            delta['exceeds_rpo'] = delta['predicted_copy_seconds'] > rpo_minutes * 60
+
+    return {
+        'throughput_bytes_per_second': throughput,
+        'throughput_source': throughput_source,
+        'volumes': deltas
+    }
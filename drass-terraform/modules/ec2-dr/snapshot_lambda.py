@@ -1,76 +1,406 @@
 import boto3
 import json
 import os
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timezone, timedelta
+from snapshot_delta import estimate_snapshot_deltas, get_dr_snapshot_pairs, DEFAULT_THROUGHPUT_MIBPS
+from snapshot_shards import split_shards, shard_name, create_run, mark_dispatched, record_shard, close_stale_runs, RUN_STALE_SECONDS
 
 ec2 = boto3.client('ec2')
 sns = boto3.client('sns')
+cloudwatch = boto3.client('cloudwatch')
+ebs = boto3.client('ebs')
+lambda_client = boto3.client('lambda')
 
-def handler(event, context):
-    instance_ids = os.environ['INSTANCE_IDS'].split(',')
+METRIC_PERIOD_SECONDS = 300
+MAX_METRIC_QUERIES = 500
+
+# Tags carried from each DR snapshot to its DR-region copy so instances can be rebuilt there
+RESTORE_TAG_KEYS = ['InstanceId', 'DeviceName', 'InstanceType', 'Architecture', 'RootDeviceName']
+
+def get_restore_metadata(instance_ids):
+    metadata = {}
+    paginator = ec2.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': instance_ids}]):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                metadata[instance['InstanceId']] = {
+                    'InstanceType': instance['InstanceType'],
+                    'Architecture': instance['Architecture'],
+                    'RootDeviceName': instance['RootDeviceName']
+                }
+    return metadata
+
+def replicate_to_dr(volume_ids, dr_region, dr_kms_key_id):
+    # CopySnapshot only accepts completed sources, so copy the latest completed snapshot that has no DR copy yet
+    latest = {volume_id: pair[1] for volume_id, pair in get_dr_snapshot_pairs(ec2, volume_ids).items()}
+    if not latest:
+        return []
+
+    dr_ec2 = boto3.client('ec2', region_name=dr_region)
+    source_ids = [snapshot['SnapshotId'] for snapshot in latest.values()]
+
+    copied = set()
+    paginator = dr_ec2.get_paginator('describe_snapshots')
+    for i in range(0, len(source_ids), 200):
+        pages = paginator.paginate(
+            Filters=[{'Name': 'tag:SourceSnapshotId', 'Values': source_ids[i:i + 200]}],
+            OwnerIds=['self']
+        )
+        for page in pages:
+            for copy in page['Snapshots']:
+                for tag in copy.get('Tags', []):
+                    if tag['Key'] == 'SourceSnapshotId':
+                        copied.add(tag['Value'])
+
+    results = []
+    for volume_id, snapshot in sorted(latest.items()):
+        if snapshot['SnapshotId'] in copied:
+            continue
+
+        tags = [tag for tag in snapshot.get('Tags', []) if tag['Key'] in RESTORE_TAG_KEYS]
+        tags += [
+            {'Key': 'SourceSnapshotId', 'Value': snapshot['SnapshotId']},
+            {'Key': 'SourceVolumeId', 'Value': volume_id}
+        ]
+        kwargs = {
+            'SourceRegion': os.environ['AWS_REGION'],
+            'SourceSnapshotId': snapshot['SnapshotId'],
+            'Description': f"DR copy of {snapshot['SnapshotId']} ({volume_id})",
+            'TagSpecifications': [{'ResourceType': 'snapshot', 'Tags': tags}]
+        }
+        if dr_kms_key_id:
+            kwargs['Encrypted'] = True
+            kwargs['KmsKeyId'] = dr_kms_key_id
+
+        try:
+            copy = dr_ec2.copy_snapshot(**kwargs)
+            results.append({
+                'volume_id': volume_id,
+                'snapshot_id': snapshot['SnapshotId'],
+                'dr_snapshot_id': copy['SnapshotId'],
+                'status': 'replicating'
+            })
+        except Exception as e:
+            results.append({
+                'volume_id': volume_id,
+                'snapshot_id': snapshot['SnapshotId'],
+                'status': 'error',
+                'error': f"DR copy failed: {str(e)}"
+            })
+
+    return results
+
+def get_last_dr_snapshots(volume_ids):
+    last_snapshots = {}
+
+    paginator = ec2.get_paginator('describe_snapshots')
+    for i in range(0, len(volume_ids), 200):
+        pages = paginator.paginate(
+            Filters=[
+                {'Name': 'volume-id', 'Values': volume_ids[i:i + 200]},
+                {'Name': 'tag:DR', 'Values': ['true']},
+                {'Name': 'status', 'Values': ['pending', 'completed']}
+            ],
+            OwnerIds=['self']
+        )
+        for page in pages:
+            for snapshot in page['Snapshots']:
+                current = last_snapshots.get(snapshot['VolumeId'])
+                if current is None or snapshot['StartTime'] > current['StartTime']:
+                    last_snapshots[snapshot['VolumeId']] = snapshot
+
+    return last_snapshots
+
+def get_volume_write_ops(volume_ids, start_time, end_time):
+    write_ops = {volume_id: [] for volume_id in volume_ids}
+
+    paginator = cloudwatch.get_paginator('get_metric_data')
+    for i in range(0, len(volume_ids), MAX_METRIC_QUERIES):
+        batch = volume_ids[i:i + MAX_METRIC_QUERIES]
+        queries = [
+            {
+                'Id': f"w{index}",
+                'Label': volume_id,
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/EBS',
+                        'MetricName': 'VolumeWriteOps',
+                        'Dimensions': [{'Name': 'VolumeId', 'Value': volume_id}]
+                    },
+                    'Period': METRIC_PERIOD_SECONDS,
+                    'Stat': 'Sum'
+                },
+                'ReturnData': True
+            }
+            for index, volume_id in enumerate(batch)
+        ]
+
+        for page in paginator.paginate(MetricDataQueries=queries, StartTime=start_time, EndTime=end_time):
+            for result in page['MetricDataResults']:
+                volume_id = batch[int(result['Id'][1:])]
+                write_ops[volume_id].extend(zip(result['Timestamps'], result['Values']))
+
+    return write_ops
+
+def select_changed_volumes(volume_ids, max_interval_minutes):
+    now = datetime.now(timezone.utc)
+    max_interval = timedelta(minutes=max_interval_minutes)
+
+    last_snapshots = get_last_dr_snapshots(volume_ids)
+
+    decisions = {}
+    to_check = []
+    for volume_id in volume_ids:
+        last_snapshot = last_snapshots.get(volume_id)
+        if last_snapshot is None:
+            decisions[volume_id] = (True, 'no previous DR snapshot')
+        elif now - last_snapshot['StartTime'] >= max_interval:
+            decisions[volume_id] = (True, f"forced: last DR snapshot older than {max_interval_minutes} minutes")
+        else:
+            to_check.append(volume_id)
+
+    if to_check:
+        # Widen the window by one period so writes in the bucket holding the snapshot still count
+        start_time = min(last_snapshots[v]['StartTime'] for v in to_check) - timedelta(seconds=METRIC_PERIOD_SECONDS)
+        write_ops = get_volume_write_ops(to_check, start_time, now)
+
+        # EBS metrics arrive minutes late, so a window without recent datapoints may hide fresh writes
+        covered_until = now - timedelta(seconds=2 * METRIC_PERIOD_SECONDS)
+
+        for volume_id in to_check:
+            since = last_snapshots[volume_id]['StartTime'] - timedelta(seconds=METRIC_PERIOD_SECONDS)
+            datapoints = [(timestamp, value) for timestamp, value in write_ops[volume_id] if timestamp >= since]
+            writes = sum(value for _, value in datapoints)
+            if writes > 0:
+                decisions[volume_id] = (True, f"{int(writes)} write ops since {last_snapshots[volume_id]['SnapshotId']}")
+            elif not datapoints or max(timestamp for timestamp, _ in datapoints) < covered_until:
+                decisions[volume_id] = (True, f"write metrics incomplete since {last_snapshots[volume_id]['SnapshotId']}")
+            else:
+                decisions[volume_id] = (False, f"no writes since {last_snapshots[volume_id]['SnapshotId']}")
+
+    return decisions
+
+def snapshot_instances(instance_ids):
     dr_region = os.environ['DR_REGION']
-    kms_key_id = os.environ.get('KMS_KEY_ID', '')
+    dr_kms_key_id = os.environ.get('DR_KMS_KEY_ID', '')
     sns_topic_arn = os.environ['SNS_TOPIC_ARN']
-    
+    change_detection = os.environ.get('CHANGE_DETECTION', 'false').lower() == 'true'
+    max_interval_minutes = int(os.environ.get('MAX_SNAPSHOT_INTERVAL_MINUTES', '1440'))
+    delta_sizing = os.environ.get('DELTA_SIZING', 'false').lower() == 'true'
+
     results = []
-    
+    candidates = []
+
+    try:
+        metadata = get_restore_metadata(instance_ids) if instance_ids else {}
+    except Exception as e:
+        # Snapshots are still usable without metadata; only AMI-based restore needs it
+        print(f"Could not read instance metadata for restore tags: {str(e)}")
+        metadata = {}
+
     for instance_id in instance_ids:
-        if not instance_id.strip():
-            continue
-            
         try:
             volumes = ec2.describe_volumes(
                 Filters=[
-                    {'Name': 'attachment.instance-id', 'Values': [instance_id.strip()]}
+                    {'Name': 'attachment.instance-id', 'Values': [instance_id]}
                 ]
             )
-            
+
             for volume in volumes['Volumes']:
-                snapshot = ec2.create_snapshot(
-                    VolumeId=volume['VolumeId'],
-                    Description=f"DR snapshot for {instance_id} - {datetime.now(timezone.utc).isoformat()}",
-                    TagSpecifications=[
-                        {
-                            'ResourceType': 'snapshot',
-                            'Tags': [
-                                {'Key': 'DR', 'Value': 'true'},
-                                {'Key': 'InstanceId', 'Value': instance_id},
-                                {'Key': 'CreatedBy', 'Value': 'Lambda'}
-                            ]
-                        }
-                    ]
+                device = next(
+                    (a['Device'] for a in volume.get('Attachments', []) if a.get('InstanceId') == instance_id),
+                    ''
                 )
-                
-                if kms_key_id:
-                    ec2.copy_snapshot(
-                        SourceRegion=os.environ['AWS_REGION'],
-                        SourceSnapshotId=snapshot['SnapshotId'],
-                        DestinationRegion=dr_region,
-                        KmsKeyId=kms_key_id,
-                        Description=f"DR copy for {instance_id}"
-                    )
-                
-                results.append({
-                    'instance_id': instance_id,
-                    'volume_id': volume['VolumeId'],
-                    'snapshot_id': snapshot['SnapshotId'],
-                    'status': 'success'
-                })
+                candidates.append((instance_id, volume['VolumeId'], device))
         except Exception as e:
             results.append({
                 'instance_id': instance_id,
                 'status': 'error',
                 'error': str(e)
             })
-            
+
             sns.publish(
                 TopicArn=sns_topic_arn,
                 Subject=f"EC2 DR Snapshot Failed: {instance_id}",
                 Message=f"Error creating snapshot for instance {instance_id}: {str(e)}"
             )
-    
+
+    decisions = {}
+    if change_detection and candidates:
+        try:
+            decisions = select_changed_volumes([volume_id for _, volume_id, _ in candidates], max_interval_minutes)
+        except Exception as e:
+            # Without write activity we cannot prove a volume is idle, so snapshot everything
+            print(f"Change detection unavailable, snapshotting all volumes: {str(e)}")
+
+    for instance_id, volume_id, device in candidates:
+        changed, reason = decisions.get(volume_id, (True, None))
+        if not changed:
+            results.append({
+                'instance_id': instance_id,
+                'volume_id': volume_id,
+                'status': 'skipped',
+                'reason': reason
+            })
+            continue
+
+        try:
+            snapshot = ec2.create_snapshot(
+                VolumeId=volume_id,
+                Description=f"DR snapshot for {instance_id} - {datetime.now(timezone.utc).isoformat()}",
+                TagSpecifications=[
+                    {
+                        'ResourceType': 'snapshot',
+                        'Tags': [
+                            {'Key': 'DR', 'Value': 'true'},
+                            {'Key': 'InstanceId', 'Value': instance_id},
+                            {'Key': 'CreatedBy', 'Value': 'Lambda'},
+                            {'Key': 'DeviceName', 'Value': device}
+                        ] + [
+                            {'Key': key, 'Value': value}
+                            for key, value in metadata.get(instance_id, {}).items()
+                        ]
+                    }
+                ]
+            )
+
+            result = {
+                'instance_id': instance_id,
+                'volume_id': volume_id,
+                'snapshot_id': snapshot['SnapshotId'],
+                'snapshot_time': snapshot['StartTime'].isoformat(),
+                'status': 'success'
+            }
+            if reason:
+                result['reason'] = reason
+            results.append(result)
+        except Exception as e:
+            results.append({
+                'instance_id': instance_id,
+                'volume_id': volume_id,
+                'status': 'error',
+                'error': str(e)
+            })
+
+            sns.publish(
+                TopicArn=sns_topic_arn,
+                Subject=f"EC2 DR Snapshot Failed: {instance_id}",
+                Message=f"Error creating snapshot for instance {instance_id}: {str(e)}"
+            )
+
+    if candidates:
+        try:
+            results.extend(replicate_to_dr(sorted({volume_id for _, volume_id, _ in candidates}), dr_region, dr_kms_key_id))
+        except Exception as e:
+            print(f"DR snapshot replication failed: {str(e)}")
+
+    if delta_sizing and candidates:
+        # New snapshots are still pending, so this sizes the previous cycle whose copies are in flight.
+        # Pairs sized by an earlier run carry their delta as tags and cost no EBS direct API calls.
+        try:
+            deltas = estimate_snapshot_deltas(
+                ec2,
+                ebs,
+                boto3.client('ec2', region_name=dr_region),
+                int(os.environ['RPO_TARGET_MINUTES']),
+                volume_ids=sorted({volume_id for _, volume_id, _ in candidates}),
+                default_throughput_mibps=float(os.environ.get('COPY_THROUGHPUT_MIBPS', DEFAULT_THROUGHPUT_MIBPS)),
+                record=True
+            )
+            by_volume = {delta['volume_id']: delta for delta in deltas['volumes']}
+            for result in results:
+                if result.get('volume_id') in by_volume:
+                    result['delta'] = by_volume[result['volume_id']]
+        except Exception as e:
+            print(f"Snapshot delta sizing failed: {str(e)}")
+
+    return results
+
+def report_stale_runs(table_name):
+    try:
+        summaries = close_stale_runs(table_name, stale_seconds=int(os.environ.get('RUN_STALE_SECONDS', RUN_STALE_SECONDS)))
+    except Exception as e:
+        print(f"Could not close stale snapshot runs: {str(e)}")
+        return
+
+    for summary in summaries:
+        print(f"EC2 DR snapshot run closed incomplete: {json.dumps(summary)}")
+        sns.publish(
+            TopicArn=os.environ['SNS_TOPIC_ARN'],
+            Subject="EC2 DR Snapshot Run Incomplete",
+            Message=(
+                f"Snapshot run {summary['run_id']} closed with {summary['shards']} of {summary['total_shards']} shards reported. "
+                f"Missing shards: {', '.join(summary['missing_shards']) or 'none'}. "
+                f"Failed shards: {', '.join(summary['failed_shards']) or 'none'}."
+            )
+        )
+
+def fan_out(instance_ids, shard_size, context):
+    table_name = os.environ['RUN_TABLE']
+    run_id = context.aws_request_id
+    shards = split_shards(instance_ids, shard_size)
+
+    report_stale_runs(table_name)
+
+    # A retried coordinator only invokes the shards it had not dispatched yet
+    dispatched = create_run(table_name, run_id, len(shards), time.time())
+
+    for index, shard in enumerate(shards):
+        shard_id = shard_name(index)
+        if shard_id in dispatched:
+            continue
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({
+                'shard': {
+                    'run_id': run_id,
+                    'shard_id': shard_id,
+                    'instance_ids': shard
+                }
+            })
+        )
+        mark_dispatched(table_name, run_id, shard_id)
+
     return {
-        'statusCode': 200,
-        'body': json.dumps(results)
+        'run_id': run_id,
+        'instances': len(instance_ids),
+        'shards': len(shards),
+        'shard_size': shard_size,
+        'already_dispatched': len(dispatched)
     }
 
+def handler(event, context):
+    event = event or {}
+
+    if 'shard' in event:
+        shard = event['shard']
+        error = None
+        try:
+            results = snapshot_instances(shard['instance_ids'])
+        except Exception as e:
+            # Report the failure so the run can still be aggregated
+            results, error = [], str(e)
+        summary = record_shard(os.environ['RUN_TABLE'], shard['run_id'], shard['shard_id'], results, error)
+        if summary:
+            # The last shard to report closes the run
+            print(f"EC2 DR snapshot run summary: {json.dumps(summary)}")
+        return {
+            'statusCode': 200 if not error else 500,
+            'body': json.dumps({'shard_id': shard['shard_id'], 'results': results, 'error': error, 'run_summary': summary})
+        }
+
+    instance_ids = [i.strip() for i in os.environ['INSTANCE_IDS'].split(',') if i.strip()]
+    shard_size = int(os.environ.get('SHARD_SIZE', '0'))
+
+    if shard_size > 0 and len(instance_ids) > shard_size and context is not None:
+        return {
+            'statusCode': 202,
+            'body': json.dumps(fan_out(instance_ids, shard_size, context))
+        }
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(snapshot_instances(instance_ids))
+    }
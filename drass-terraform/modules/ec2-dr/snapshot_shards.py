@@ -0,0 +1,223 @@
+"""
+EC2 Snapshot Shard Tracking
+Records the results of sharded snapshot workers in DynamoDB and aggregates
+them into a run summary once the last shard has reported.
+"""
+
+import json
+import time
+from datetime import datetime
+import boto3
+from botocore.exceptions import ClientError
+
+RUN_ITEM = '#run'
+OPEN_RUNS = '#open'
+RUN_TTL_SECONDS = 7 * 24 * 3600
+
+# Default age after which an unreported shard is treated as lost; the Lambda derives it
+# from the maximum event age of its async invoke config, which bounds throttled retries
+RUN_STALE_SECONDS = 3600
+
+dynamodb = boto3.client('dynamodb')
+
+def split_shards(instance_ids, shard_size):
+    return [instance_ids[i:i + shard_size] for i in range(0, len(instance_ids), shard_size)]
+
+def shard_name(index):
+    return f"shard-{index:05d}"
+
+def _is_conditional_failure(e):
+    return e.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+def create_run(table_name, run_id, total_shards, started_at):
+    # Open runs are indexed under one partition so stale ones can be found without a scan
+    dynamodb.put_item(
+        TableName=table_name,
+        Item={
+            'run_id': {'S': OPEN_RUNS},
+            'shard_id': {'S': run_id},
+            'started_at': {'N': str(started_at)},
+            'expires_at': {'N': str(int(started_at) + RUN_TTL_SECONDS)}
+        }
+    )
+
+    # A retried coordinator reuses the request ID and must not reset the run
+    try:
+        dynamodb.put_item(
+            TableName=table_name,
+            Item={
+                'run_id': {'S': run_id},
+                'shard_id': {'S': RUN_ITEM},
+                'total_shards': {'N': str(total_shards)},
+                'completed_shards': {'N': '0'},
+                'started_at': {'N': str(started_at)},
+                'expires_at': {'N': str(int(started_at) + RUN_TTL_SECONDS)}
+            },
+            ConditionExpression='attribute_not_exists(run_id)'
+        )
+        return set()
+    except ClientError as e:
+        if not _is_conditional_failure(e):
+            raise
+
+    run = dynamodb.get_item(
+        TableName=table_name,
+        Key={'run_id': {'S': run_id}, 'shard_id': {'S': RUN_ITEM}},
+        ConsistentRead=True
+    )['Item']
+    return set(run.get('dispatched_shards', {}).get('SS', []))
+
+def mark_dispatched(table_name, run_id, shard_id):
+    dynamodb.update_item(
+        TableName=table_name,
+        Key={'run_id': {'S': run_id}, 'shard_id': {'S': RUN_ITEM}},
+        UpdateExpression='ADD dispatched_shards :shard',
+        ExpressionAttributeValues={':shard': {'SS': [shard_id]}}
+    )
+
+def summarize_shard(results, error=None):
+    snapshot_times = [r['snapshot_time'] for r in results if r.get('snapshot_time')]
+    summary = {
+        'success': sum(1 for r in results if r['status'] == 'success'),
+        'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+        'errors': sum(1 for r in results if r['status'] == 'error'),
+        'first_snapshot_at': min(snapshot_times) if snapshot_times else None,
+        'last_snapshot_at': max(snapshot_times) if snapshot_times else None
+    }
+    if error:
+        summary['error'] = error
+    return summary
+
+def record_shard(table_name, run_id, shard_id, results, error=None):
+    # Only counts and timestamps are stored, so the item size does not grow with the shard
+    summary = summarize_shard(results, error)
+    item = {
+        'run_id': {'S': run_id},
+        'shard_id': {'S': shard_id},
+        'finished_at': {'N': str(time.time())},
+        'summary': {'S': json.dumps(summary)},
+        'expires_at': {'N': str(int(time.time()) + RUN_TTL_SECONDS)}
+    }
+
+    # A retried worker overwrites its shard but must not be counted twice
+    try:
+        dynamodb.put_item(
+            TableName=table_name,
+            Item=item,
+            ConditionExpression='attribute_not_exists(shard_id)'
+        )
+    except ClientError as e:
+        if not _is_conditional_failure(e):
+            raise
+        dynamodb.put_item(TableName=table_name, Item=item)
+        return None
+
+    run = dynamodb.update_item(
+        TableName=table_name,
+        Key={'run_id': {'S': run_id}, 'shard_id': {'S': RUN_ITEM}},
+        UpdateExpression='ADD completed_shards :one',
+        ExpressionAttributeValues={':one': {'N': '1'}},
+        ReturnValues='ALL_NEW'
+    )['Attributes']
+
+    if int(run['completed_shards']['N']) < int(run['total_shards']['N']):
+        return None
+    return aggregate_run(table_name, run_id, run)
+
+def aggregate_run(table_name, run_id, run):
+    shards = {}
+    paginator = dynamodb.get_paginator('query')
+    pages = paginator.paginate(
+        TableName=table_name,
+        KeyConditionExpression='run_id = :id',
+        ExpressionAttributeValues={':id': {'S': run_id}},
+        ConsistentRead=True
+    )
+    for page in pages:
+        for item in page['Items']:
+            if item['shard_id']['S'] != RUN_ITEM:
+                shards[item['shard_id']['S']] = dict(json.loads(item['summary']['S']), finished_at=float(item['finished_at']['N']))
+
+    started_at = float(run['started_at']['N'])
+    total_shards = int(run['total_shards']['N'])
+    reported = list(shards.values())
+    finished = [s['finished_at'] for s in reported]
+    first_snapshots = [s['first_snapshot_at'] for s in reported if s['first_snapshot_at']]
+    last_snapshots = [s['last_snapshot_at'] for s in reported if s['last_snapshot_at']]
+    missing = [shard_name(i) for i in range(total_shards) if shard_name(i) not in shards]
+
+    summary = {
+        'run_id': run_id,
+        'complete': not missing,
+        'shards': len(reported),
+        'total_shards': total_shards,
+        'missing_shards': missing,
+        'failed_shards': sorted(shard_id for shard_id, s in shards.items() if s.get('error')),
+        'success': sum(s['success'] for s in reported),
+        'skipped': sum(s['skipped'] for s in reported),
+        'errors': sum(s['errors'] for s in reported),
+        'total_completion_seconds': round(max(finished) - started_at, 1) if finished else None,
+        'first_snapshot_at': min(first_snapshots) if first_snapshots else None,
+        'last_snapshot_at': max(last_snapshots) if last_snapshots else None,
+        'shard_finish_spread_seconds': round(max(finished) - min(finished), 1) if finished else None
+    }
+    if first_snapshots:
+        # Snapshot times are UTC ISO strings, so min/max above are chronological
+        summary['snapshot_spread_seconds'] = round(
+            (datetime.fromisoformat(summary['last_snapshot_at']) - datetime.fromisoformat(summary['first_snapshot_at'])).total_seconds(), 1
+        )
+
+    # The last shard and a stale-run sweep can race; only the first summary is kept
+    try:
+        dynamodb.update_item(
+            TableName=table_name,
+            Key={'run_id': {'S': run_id}, 'shard_id': {'S': RUN_ITEM}},
+            UpdateExpression='SET #summary = :summary',
+            ConditionExpression='attribute_not_exists(#summary)',
+            ExpressionAttributeNames={'#summary': 'summary'},
+            ExpressionAttributeValues={':summary': {'S': json.dumps(summary)}}
+        )
+    except ClientError as e:
+        if not _is_conditional_failure(e):
+            raise
+        summary = None
+
+    dynamodb.delete_item(
+        TableName=table_name,
+        Key={'run_id': {'S': OPEN_RUNS}, 'shard_id': {'S': run_id}}
+    )
+    return summary
+
+def close_stale_runs(table_name, now=None, stale_seconds=RUN_STALE_SECONDS):
+    # Runs whose workers timed out or crashed never reach the last-shard aggregation
+    now = now or time.time()
+    summaries = []
+
+    paginator = dynamodb.get_paginator('query')
+    pages = paginator.paginate(
+        TableName=table_name,
+        KeyConditionExpression='run_id = :open',
+        ExpressionAttributeValues={':open': {'S': OPEN_RUNS}},
+        ConsistentRead=True
+    )
+    for page in pages:
+        for item in page['Items']:
+            if float(item['started_at']['N']) > now - stale_seconds:
+                continue
+            run_id = item['shard_id']['S']
+            run = dynamodb.get_item(
+                TableName=table_name,
+                Key={'run_id': {'S': run_id}, 'shard_id': {'S': RUN_ITEM}},
+                ConsistentRead=True
+            ).get('Item')
+            if run is None or 'summary' in run:
+                dynamodb.delete_item(
+                    TableName=table_name,
+                    Key={'run_id': {'S': OPEN_RUNS}, 'shard_id': {'S': run_id}}
+                )
+                continue
+            summary = aggregate_run(table_name, run_id, run)
+            if summary:
+                summaries.append(summary)
+
+    return summaries
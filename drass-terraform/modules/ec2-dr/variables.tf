@@ -24,6 +24,12 @@ variable "kms_key_id" {
   default     = null
 }
 
+variable "kms_key_id_dr" {
+  description = "KMS key ID in the DR region for encrypting snapshot copies"
+  type        = string
+  default     = null
+}
+
 variable "sns_topic_arn" {
   description = "SNS topic ARN for alerts"
   type        = string
@@ -34,6 +40,36 @@ variable "rpo_target_minutes" {
   type        = number
 }
 
+variable "enable_change_detection" {
+  description = "Only snapshot volumes with VolumeWriteOps since their last DR snapshot"
+  type        = bool
+  default     = false
+}
+
+variable "max_snapshot_interval_minutes" {
+  description = "Maximum minutes between DR snapshots of an idle volume when change detection is enabled"
+  type        = number
+  default     = 1440
+}
+
+variable "enable_delta_sizing" {
+  description = "Measure changed bytes between DR snapshots and predict cross-region copy time"
+  type        = bool
+  default     = false
+}
+
+variable "copy_throughput_mibps" {
+  description = "Assumed snapshot copy throughput in MiB/s when no in-flight copy can be observed"
+  type        = number
+  default     = 25
+}
+
+variable "shard_size" {
+  description = "Instances per snapshot worker invocation; 0 processes the whole list in one invocation"
+  type        = number
+  default     = 0
+}
+
 variable "environment" {
   description = "Environment name"
   type        = string
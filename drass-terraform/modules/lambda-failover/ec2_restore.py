@@ -0,0 +1,166 @@
+"""
+EC2 DR Restore
+Rebuilds protected EC2 instances in the DR region from the latest completed
+snapshot copies made by the ec2-dr snapshot Lambda.
+"""
+
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import WaiterError
+
+MAX_WORKERS = 10
+WAITER_DELAY_SECONDS = 15
+
+def index_dr_snapshot_copies(dr_ec2, instance_ids=None):
+    filters = [
+        {'Name': 'tag-key', 'Values': ['SourceVolumeId']},
+        {'Name': 'status', 'Values': ['completed']}
+    ]
+    if instance_ids:
+        filters.append({'Name': 'tag:InstanceId', 'Values': instance_ids})
+
+    latest = {}
+    paginator = dr_ec2.get_paginator('describe_snapshots')
+    for page in paginator.paginate(Filters=filters, OwnerIds=['self']):
+        for snapshot in page['Snapshots']:
+            tags = {tag['Key']: tag['Value'] for tag in snapshot.get('Tags', [])}
+            volume_id = tags['SourceVolumeId']
+            current = latest.get(volume_id)
+            if current is None or snapshot['StartTime'] > current['start_time']:
+                latest[volume_id] = {
+                    'snapshot_id': snapshot['SnapshotId'],
+                    'start_time': snapshot['StartTime'],
+                    'tags': tags
+                }
+
+    by_instance = {}
+    for volume_id, copy in latest.items():
+        instance_id = copy['tags'].get('InstanceId')
+        if instance_id:
+            by_instance.setdefault(instance_id, []).append(dict(copy, source_volume_id=volume_id))
+    return by_instance
+
+def _client_token(*parts):
+    return hashlib.sha256('/'.join(parts).encode()).hexdigest()[:64]
+
+def _waiter_config(deadline):
+    attempts = int((deadline - time.monotonic()) // WAITER_DELAY_SECONDS)
+    return {'Delay': WAITER_DELAY_SECONDS, 'MaxAttempts': max(1, attempts)}
+
+def _register_image(dr_ec2, name, root, copies):
+    # The image name is the idempotency key for a retried restore
+    existing = dr_ec2.describe_images(Owners=['self'], Filters=[{'Name': 'name', 'Values': [name]}])['Images']
+    if existing:
+        return existing[0]['ImageId']
+
+    image = dr_ec2.register_image(
+        Name=name,
+        Description=f"DR restore of {root['tags']['InstanceId']}",
+        Architecture=root['tags'].get('Architecture', 'x86_64'),
+        RootDeviceName=root['tags']['RootDeviceName'],
+        VirtualizationType='hvm',
+        EnaSupport=True,
+        BlockDeviceMappings=[
+            {
+                'DeviceName': copy['tags']['DeviceName'],
+                'Ebs': {'SnapshotId': copy['snapshot_id'], 'DeleteOnTermination': False}
+            }
+            for copy in copies if copy['tags'].get('DeviceName')
+        ]
+    )
+    return image['ImageId']
+
+def restore_instance(dr_ec2, failover_id, source_instance_id, copies, started_at, subnet_id,
+                     security_group_ids, availability_zone, deadline):
+    result = {
+        'source_instance_id': source_instance_id,
+        'snapshot_ids': [c['snapshot_id'] for c in copies],
+        'started_at': started_at
+    }
+    root = next(
+        (c for c in copies if c['tags'].get('DeviceName') and c['tags'].get('DeviceName') == c['tags'].get('RootDeviceName')),
+        None
+    )
+    tags = [
+        {'Key': 'Name', 'Value': f"restored-{source_instance_id}"},
+        {'Key': 'RestoredFrom', 'Value': source_instance_id},
+        {'Key': 'FailoverId', 'Value': failover_id}
+    ]
+
+    try:
+        if root and subnet_id:
+            image_id = _register_image(dr_ec2, f"dr-restore-{source_instance_id}-{_client_token(failover_id)[:12]}", root, copies)
+            dr_ec2.get_waiter('image_available').wait(ImageIds=[image_id], WaiterConfig=_waiter_config(deadline))
+
+            kwargs = {
+                'ImageId': image_id,
+                'InstanceType': root['tags'].get('InstanceType', 't3.micro'),
+                'MinCount': 1,
+                'MaxCount': 1,
+                'SubnetId': subnet_id,
+                'ClientToken': _client_token(failover_id, source_instance_id),
+                'TagSpecifications': [{'ResourceType': 'instance', 'Tags': tags}]
+            }
+            if security_group_ids:
+                kwargs['SecurityGroupIds'] = security_group_ids
+            instance_id = dr_ec2.run_instances(**kwargs)['Instances'][0]['InstanceId']
+            result.update({'method': 'ami', 'image_id': image_id, 'restored_instance_id': instance_id})
+
+            dr_ec2.get_waiter('instance_running').wait(InstanceIds=[instance_id], WaiterConfig=_waiter_config(deadline))
+        else:
+            # Without a root volume copy or a subnet, restore data volumes for manual attachment
+            volume_ids = []
+            for copy in copies:
+                volume = dr_ec2.create_volume(
+                    SnapshotId=copy['snapshot_id'],
+                    AvailabilityZone=availability_zone,
+                    ClientToken=_client_token(failover_id, copy['source_volume_id']),
+                    TagSpecifications=[{'ResourceType': 'volume', 'Tags': tags + [
+                        {'Key': 'SourceVolumeId', 'Value': copy['source_volume_id']}
+                    ]}]
+                )
+                volume_ids.append(volume['VolumeId'])
+            result.update({'method': 'volumes', 'restored_volume_ids': volume_ids})
+
+            dr_ec2.get_waiter('volume_available').wait(VolumeIds=volume_ids, WaiterConfig=_waiter_config(deadline))
+
+        result['status'] = 'completed'
+    except WaiterError as e:
+        # Running out of time is resumable: every create call above is idempotent
+        result['status'] = 'pending' if 'Max attempts exceeded' in str(e) else 'failed'
+        if result['status'] == 'failed':
+            result['error'] = str(e)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+
+    # Wall-clock time from the first attempt, which may have been in an earlier invocation
+    result['restore_seconds'] = round(time.time() - started_at, 1)
+    return result
+
+def restore_instances(dr_ec2, failover_id, copies_by_instance, started_at, subnet_id, security_group_ids,
+                      rto_seconds, deadline):
+    if not copies_by_instance:
+        return []
+
+    if subnet_id:
+        availability_zone = dr_ec2.describe_subnets(SubnetIds=[subnet_id])['Subnets'][0]['AvailabilityZone']
+    else:
+        zones = dr_ec2.describe_availability_zones(Filters=[{'Name': 'state', 'Values': ['available']}])
+        availability_zone = zones['AvailabilityZones'][0]['ZoneName']
+
+    def restore(source_instance_id):
+        return restore_instance(
+            dr_ec2, failover_id, source_instance_id, copies_by_instance[source_instance_id],
+            started_at[source_instance_id], subnet_id, security_group_ids, availability_zone, deadline
+        )
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(copies_by_instance))) as executor:
+        results = list(executor.map(restore, sorted(copies_by_instance)))
+
+    for result in results:
+        if result['status'] == 'completed':
+            result['within_rto'] = result['restore_seconds'] <= rto_seconds
+
+    return results
@@ -4,8 +4,53 @@ locals {
 
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/failover_lambda.py"
   output_path = "${path.module}/failover_lambda.zip"
+
+  source {
+    content  = file("${path.module}/failover_lambda.py")
+    filename = "failover_lambda.py"
+  }
+
+  source {
+    content  = file("${path.module}/failover_checkpoint.py")
+    filename = "failover_checkpoint.py"
+  }
+
+  source {
+    content  = file("${path.module}/ec2_restore.py")
+    filename = "ec2_restore.py"
+  }
+}
+
+resource "aws_dynamodb_table" "failover_checkpoints" {
+  name         = "${local.name_prefix}-failover-checkpoints"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "failover_id"
+  range_key    = "step"
+
+  attribute {
+    name = "failover_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "step"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  server_side_encryption {
+    enabled     = true
+    kms_key_arn = var.kms_key_id
+  }
+
+  tags = merge(var.tags, {
+    Name = "${local.name_prefix}-failover-checkpoints"
+  })
 }
 
 resource "aws_lambda_function" "failover" {
@@ -17,11 +62,20 @@ resource "aws_lambda_function" "failover" {
   timeout         = 900
   memory_size     = 512
 
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+
   environment {
     variables = {
       DR_REGION     = var.dr_region
       SNS_TOPIC_ARN = var.sns_topic_arn
       RTO_TARGET    = var.rto_target
+
+      APPLICATION_TAG_KEY = var.application_tag_key
+      CHECKPOINT_TABLE    = aws_dynamodb_table.failover_checkpoints.name
+
+      EC2_RESTORE           = tostring(var.enable_ec2_restore)
+      DR_SUBNET_ID          = var.dr_subnet_id
+      DR_SECURITY_GROUP_IDS = join(",", var.dr_security_group_ids)
     }
   }
 
@@ -73,14 +127,40 @@ resource "aws_iam_role_policy" "lambda_failover" {
           "ec2:DescribeInstances",
           "ec2:StartInstances",
           "ec2:StopInstances",
+          "ec2:DescribeSnapshots",
+          "ec2:DescribeImages",
+          "ec2:RegisterImage",
+          "ec2:RunInstances",
+          "ec2:CreateVolume",
+          "ec2:DescribeVolumes",
+          "ec2:DescribeSubnets",
+          "ec2:DescribeAvailabilityZones",
           "dynamodb:DescribeTable",
           "s3:GetBucketReplication",
           "s3:PutBucketReplication",
           "backup:StartRestoreJob",
-          "backup:DescribeBackupJob"
+          "backup:DescribeBackupJob",
+          "backup:ListBackupJobs",
+          "tag:GetResources"
         ]
         Resource = "*"
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem",
+          "dynamodb:Query"
+        ]
+        Resource = aws_dynamodb_table.failover_checkpoints.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = "arn:aws:lambda:*:*:function:${local.name_prefix}-failover"
+      },
       {
         Effect = "Allow"
         Action = [
@@ -92,9 +172,13 @@ resource "aws_iam_role_policy" "lambda_failover" {
         Effect = "Allow"
         Action = [
           "kms:Decrypt",
-          "kms:Encrypt"
+          "kms:Encrypt",
+          "kms:CreateGrant",
+          "kms:DescribeKey",
+          "kms:GenerateDataKeyWithoutPlaintext",
+          "kms:ReEncrypt*"
         ]
-        Resource = var.kms_key_id != null ? [var.kms_key_id] : ["*"]
+        Resource = var.kms_key_id != null ? compact([var.kms_key_id, var.kms_key_id_dr]) : ["*"]
       }
     ]
   })
@@ -3,6 +3,11 @@ output "lambda_arn" {
   value       = aws_lambda_function.failover.arn
 }
 
+output "checkpoint_table_name" {
+  description = "DynamoDB table holding failover checkpoints"
+  value       = aws_dynamodb_table.failover_checkpoints.name
+}
+
 output "lambda_function_name" {
   description = "Failover Lambda function name"
   value       = aws_lambda_function.failover.function_name
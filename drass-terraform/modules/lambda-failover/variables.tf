@@ -24,11 +24,41 @@ variable "kms_key_id" {
   default     = null
 }
 
+variable "kms_key_id_dr" {
+  description = "KMS key ID in the DR region used by restored volumes"
+  type        = string
+  default     = null
+}
+
+variable "enable_ec2_restore" {
+  description = "Restore protected EC2 instances from DR-region snapshot copies during failover"
+  type        = bool
+  default     = false
+}
+
+variable "dr_subnet_id" {
+  description = "DR-region subnet for restored EC2 instances (volumes only are restored when empty)"
+  type        = string
+  default     = ""
+}
+
+variable "dr_security_group_ids" {
+  description = "DR-region security groups for restored EC2 instances"
+  type        = list(string)
+  default     = []
+}
+
 variable "rto_target" {
   description = "RTO target in minutes"
   type        = number
 }
 
+variable "application_tag_key" {
+  description = "Tag key that identifies a resource's application group in scoped failover events"
+  type        = string
+  default     = "Application"
+}
+
 variable "environment" {
   description = "Environment name"
   type        = string
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+DR Readiness History Store
+Appends readiness measurements to a local columnar store and computes
+RPO/RTO percentile, breach-window and trend reports over it.
+"""
+
+import os
+import re
+import sys
+from array import array
+from datetime import datetime, timezone, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+METRICS = ['snapshot_age_minutes', 'replica_lag_seconds', 'backup_success']
+
+# One append-only file per column; resource names are dictionary-encoded
+COLUMNS = [
+    ('timestamp', 'd', '<f8', 'timestamp.f64'),
+    ('resource', 'I', '<u4', 'resource.u32'),
+    ('metric', 'B', 'u1', 'metric.u8'),
+    ('value', 'd', '<f8', 'value.f64'),
+]
+
+RESOURCES_FILE = 'resources.txt'
+
+PERCENTILES = [50, 90, 99]
+
+def record_measurement(measurements, resource, metric, value, timestamp=None):
+    if measurements is None or value is None:
+        return
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc)
+    measurements.append((timestamp, resource, metric, float(value)))
+
+def _load_resources(history_dir):
+    path = os.path.join(history_dir, RESOURCES_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+def _repair_columns(history_dir):
+    # An interrupted append leaves columns of different lengths; appending on top of that
+    # would misalign every later row, so cut all columns back to the rows they share
+    paths = [(os.path.join(history_dir, filename), array(typecode).itemsize) for _, typecode, _, filename in COLUMNS]
+    if not any(os.path.exists(path) for path, _ in paths):
+        return
+    rows = min(os.path.getsize(path) // itemsize if os.path.exists(path) else 0 for path, itemsize in paths)
+    for path, itemsize in paths:
+        if os.path.exists(path) and os.path.getsize(path) != rows * itemsize:
+            os.truncate(path, rows * itemsize)
+
+def append_measurements(history_dir, measurements):
+    if not measurements:
+        return 0
+
+    os.makedirs(history_dir, exist_ok=True)
+    _repair_columns(history_dir)
+
+    resources = _load_resources(history_dir)
+    codes = {name: code for code, name in enumerate(resources)}
+    new_resources = []
+
+    columns = {name: array(typecode) for name, typecode, _, _ in COLUMNS}
+
+    for timestamp, resource, metric, value in measurements:
+        if resource not in codes:
+            codes[resource] = len(codes)
+            new_resources.append(resource)
+        columns['timestamp'].append(timestamp.timestamp())
+        columns['resource'].append(codes[resource])
+        columns['metric'].append(METRICS.index(metric))
+        columns['value'].append(value)
+
+    if new_resources:
+        with open(os.path.join(history_dir, RESOURCES_FILE), 'a', encoding='utf-8') as f:
+            for resource in new_resources:
+                f.write(f"{resource}\n")
+
+    for name, _, _, filename in COLUMNS:
+        column = columns[name]
+        if sys.byteorder == 'big':
+            column.byteswap()
+        with open(os.path.join(history_dir, filename), 'ab') as f:
+            column.tofile(f)
+
+    return len(measurements)
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("NumPy is required for history reports (pip3 install numpy)")
+
+def load_history(history_dir):
+    _require_numpy()
+
+    data = {}
+    for name, _, dtype, filename in COLUMNS:
+        path = os.path.join(history_dir, filename)
+        if os.path.exists(path):
+            data[name] = np.fromfile(path, dtype=dtype)
+        else:
+            data[name] = np.empty(0, dtype=dtype)
+
+    # An interrupted append can leave columns with different lengths until the next append repairs them
+    rows = min(len(column) for column in data.values())
+    for name in data:
+        data[name] = data[name][:rows]
+
+    data['resources'] = _load_resources(history_dir)
+    return data
+
+def parse_since(value, now=None):
+    now = now or datetime.now(timezone.utc)
+
+    match = re.fullmatch(r'(\d+)([mhdw])', value.strip().lower())
+    if match:
+        amount = int(match.group(1))
+        unit = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}[match.group(2)]
+        return now - timedelta(**{unit: amount})
+
+    since = datetime.fromisoformat(value.strip())
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return since
+
+def _dedupe_samples(groups, timestamps, values):
+    # Sorted by resource then time, keeping one row per resource and timestamp
+    order = np.lexsort((timestamps, groups))
+    groups, timestamps, values = groups[order], timestamps[order], values[order]
+    keep = np.ones(len(groups), dtype=bool)
+    keep[1:] = (groups[1:] != groups[:-1]) | (timestamps[1:] != timestamps[:-1])
+    return groups[keep], timestamps[keep], values[keep]
+
+def _group_percentiles(groups, values):
+    order = np.lexsort((values, groups))
+    sorted_groups = groups[order]
+    sorted_values = values[order]
+
+    unique_groups, starts, counts = np.unique(sorted_groups, return_index=True, return_counts=True)
+
+    percentiles = {}
+    for p in PERCENTILES:
+        position = starts + (counts - 1) * (p / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        fraction = position - lower
+        percentiles[p] = sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+    maximum = sorted_values[starts + counts - 1]
+    return unique_groups, counts, percentiles, maximum
+
+def _group_breach_windows(groups, timestamps, values, threshold, group_count):
+    order = np.lexsort((timestamps, groups))
+    sorted_groups = groups[order]
+    sorted_timestamps = timestamps[order]
+    breach = values[order] > threshold
+
+    first_in_group = np.ones(len(sorted_groups), dtype=bool)
+    first_in_group[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    last_in_group = np.ones(len(sorted_groups), dtype=bool)
+    last_in_group[:-1] = first_in_group[1:]
+
+    previous_breach = np.concatenate(([False], breach[:-1]))
+    next_breach = np.concatenate((breach[1:], [False]))
+
+    window_starts = np.flatnonzero(breach & (first_in_group | ~previous_breach))
+    window_ends = np.flatnonzero(breach & (last_in_group | ~next_breach))
+
+    # A breach lasts until the next non-breaching sample; an ongoing one is credited one run interval
+    same_group = ~first_in_group[1:]
+    gaps = (sorted_timestamps[1:] - sorted_timestamps[:-1])[same_group]
+    run_interval = float(np.median(gaps)) if len(gaps) else 0.0
+    next_timestamps = np.concatenate((sorted_timestamps[1:], [0.0]))
+    window_end_times = np.where(
+        last_in_group[window_ends],
+        sorted_timestamps[window_ends] + run_interval,
+        next_timestamps[window_ends]
+    )
+
+    window_groups = sorted_groups[window_starts]
+    durations = window_end_times - sorted_timestamps[window_starts]
+
+    windows = np.bincount(window_groups, minlength=group_count)
+    breach_seconds = np.bincount(window_groups, weights=durations, minlength=group_count)
+    longest = np.zeros(group_count)
+    np.maximum.at(longest, window_groups, durations)
+    ongoing = np.zeros(group_count, dtype=bool)
+    ongoing[sorted_groups[breach & last_in_group]] = True
+
+    return windows, breach_seconds, longest, ongoing
+
+def _group_trend(groups, timestamps, values, group_count):
+    # Least-squares slope per resource, in metric units per day
+    x = (timestamps - timestamps.min()) / 86400.0
+    n = np.bincount(groups, minlength=group_count).astype(np.float64)
+    sx = np.bincount(groups, weights=x, minlength=group_count)
+    sy = np.bincount(groups, weights=values, minlength=group_count)
+    sxx = np.bincount(groups, weights=x * x, minlength=group_count)
+    sxy = np.bincount(groups, weights=x * values, minlength=group_count)
+
+    denominator = n * sxx - sx * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(denominator > 0, (n * sxy - sx * sy) / denominator, 0.0)
+    return slope
+
+def build_report(history, since, thresholds):
+    _require_numpy()
+
+    resources = history['resources']
+    group_count = len(resources)
+    in_window = history['timestamp'] >= since.timestamp()
+
+    report = {
+        'rows': int(np.count_nonzero(in_window)),
+        'metrics': {}
+    }
+
+    for metric, threshold in thresholds.items():
+        mask = in_window & (history['metric'] == METRICS.index(metric))
+        if not mask.any():
+            continue
+
+        # Replica lag is stamped with its CloudWatch datapoint, so runs within one period repeat it
+        groups, timestamps, values = _dedupe_samples(
+            history['resource'][mask].astype(np.int64),
+            history['timestamp'][mask],
+            history['value'][mask]
+        )
+
+        unique_groups, counts, percentiles, maximum = _group_percentiles(groups, values)
+        windows, breach_seconds, longest, ongoing = _group_breach_windows(
+            groups, timestamps, values, threshold, group_count
+        )
+        slope = _group_trend(groups, timestamps, values, group_count)
+
+        report['metrics'][metric] = {
+            'threshold': threshold,
+            'overall': {p: float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+            'resources': [
+                {
+                    'resource': resources[group],
+                    'samples': int(counts[i]),
+                    'percentiles': {p: float(percentiles[p][i]) for p in PERCENTILES},
+                    'max': float(maximum[i]),
+                    'breach_windows': int(windows[group]),
+                    'breach_seconds': float(breach_seconds[group]),
+                    'longest_breach_seconds': float(longest[group]),
+                    'ongoing_breach': bool(ongoing[group]),
+                    'trend_per_day': float(slope[group])
+                }
+                for i, group in enumerate(unique_groups)
+            ]
+        }
+
+    mask = in_window & (history['metric'] == METRICS.index('backup_success'))
+    if mask.any():
+        # Every run re-lists recent jobs, so keep one row per resource and job start time
+        groups, _, values = _dedupe_samples(
+            history['resource'][mask].astype(np.int64),
+            history['timestamp'][mask],
+            history['value'][mask]
+        )
+
+        jobs = np.bincount(groups, minlength=group_count)
+        successes = np.bincount(groups, weights=values, minlength=group_count)
+
+        report['metrics']['backup_success'] = {
+            'overall_rate': float(values.mean()),
+            'resources': [
+                {
+                    'resource': resources[group],
+                    'jobs': int(jobs[group]),
+                    'successes': int(successes[group]),
+                    'rate': float(successes[group] / jobs[group])
+                }
+                for group in np.flatnonzero(jobs)
+            ]
+        }
+
+    return report
@@ -9,6 +9,8 @@ import argparse
 import sys
 from datetime import datetime, timezone, timedelta
 from botocore.exceptions import ClientError, BotoCoreError
+from snapshot_delta import estimate_snapshot_deltas, DEFAULT_THROUGHPUT_MIBPS
+from dr_history import record_measurement, append_measurements, load_history, parse_since, build_report, PERCENTILES
 
 def get_primary_region():
     session = boto3.Session()
@@ -36,7 +38,7 @@ def print_section_header(title):
 def print_warning(message):
     print(f"  WARNING: {message}")
 
-def check_ec2_snapshots(ec2_client, dr_region, rpo_minutes):
+def check_ec2_snapshots(ec2_client, dr_region, rpo_minutes, measurements=None):
     print_section_header("EC2 Snapshot & Replication Status")
     
     issues = []
@@ -73,6 +75,7 @@ def check_ec2_snapshots(ec2_client, dr_region, rpo_minutes):
                 if age:
                     age_minutes = age.total_seconds() / 60
                     print(f"    Age: {int(age_minutes)} minutes")
+                    record_measurement(measurements, f"ec2:{volume_id}", 'snapshot_age_minutes', age_minutes)
                     
                     if age_minutes > rpo_minutes:
                         warning = f"Snapshot for volume {volume_id} is older than RPO target ({rpo_minutes} minutes)"
@@ -111,12 +114,142 @@ def check_ec2_snapshots(ec2_client, dr_region, rpo_minutes):
     
     return issues
 
-def check_rds_dr(rds_client, dr_region, rpo_minutes, replica_lag_threshold):
+def format_bytes(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+def check_ec2_snapshot_deltas(ec2_client, dr_region, rpo_minutes, throughput_mibps):
+    print_section_header("EC2 Snapshot Delta & Copy Time Forecast")
+    
+    issues = []
+    
+    try:
+        # Only volumes still attached to an instance matter; detached ones keep old DR snapshots around
+        attached_volume_ids = []
+        paginator = ec2_client.get_paginator('describe_volumes')
+        for page in paginator.paginate(Filters=[{'Name': 'attachment.status', 'Values': ['attached']}]):
+            attached_volume_ids.extend(volume['VolumeId'] for volume in page['Volumes'])
+        
+        if not attached_volume_ids:
+            print("  No attached EBS volumes to size.")
+            return issues
+        
+        region = ec2_client.meta.region_name
+        forecast = estimate_snapshot_deltas(
+            ec2_client,
+            boto3.client('ebs', region_name=region),
+            boto3.client('ec2', region_name=dr_region),
+            rpo_minutes,
+            volume_ids=attached_volume_ids,
+            default_throughput_mibps=throughput_mibps
+        )
+        
+        if not forecast['volumes']:
+            print("  No completed DR snapshots to size.")
+            return issues
+        
+        throughput_mibps = forecast['throughput_bytes_per_second'] / (1024 * 1024)
+        print(f"  Copy Throughput: {throughput_mibps:.1f} MiB/s ({forecast['throughput_source']})\n")
+        
+        for delta in forecast['volumes']:
+            print(f"  Volume: {delta['volume_id']}")
+            print(f"    Snapshot: {delta['snapshot_id']} (previous: {delta['previous_snapshot_id'] or 'none'})")
+            
+            if 'error' in delta:
+                warning = f"Could not size snapshot {delta['snapshot_id']}: {delta['error']}"
+                print_warning(warning)
+                issues.append(warning)
+                print()
+                continue
+            
+            print(f"    Changed Data: {format_bytes(delta['changed_bytes'])} ({delta['changed_blocks']} blocks)")
+            print(f"    Predicted Copy Time: {int(delta['predicted_copy_seconds'] / 60)} minutes")
+            
+            if delta['exceeds_rpo']:
+                warning = f"Predicted copy time for volume {delta['volume_id']} exceeds RPO target ({rpo_minutes} minutes)"
+                print_warning(warning)
+                issues.append(warning)
+            
+            print()
+    
+    except Exception as e:
+        error_msg = f"Error sizing EC2 snapshot deltas: {str(e)}"
+        print_warning(error_msg)
+        issues.append(error_msg)
+    
+    return issues
+
+def _index_latest(index, key, record):
+    if not key or not isinstance(record['snapshot_time'], datetime):
+        return
+    current = index.get(key)
+    if current is None or record['snapshot_time'] > current['snapshot_time']:
+        index[key] = record
+
+def build_rds_snapshot_index(rds_client, include_automated_backups=False):
+    index = {'instances': {}, 'clusters': {}}
+    
+    # SnapshotType is left unset so manual and automated snapshots come back together
+    for page in rds_client.get_paginator('describe_db_snapshots').paginate():
+        for snapshot in page.get('DBSnapshots', []):
+            _index_latest(index['instances'], snapshot.get('DBInstanceIdentifier'), {
+                'snapshot_id': snapshot['DBSnapshotIdentifier'],
+                'snapshot_time': snapshot.get('SnapshotCreateTime'),
+                'snapshot_type': snapshot.get('SnapshotType', 'manual'),
+                'status': snapshot.get('Status', 'unknown')
+            })
+    
+    for page in rds_client.get_paginator('describe_db_cluster_snapshots').paginate():
+        for snapshot in page.get('DBClusterSnapshots', []):
+            _index_latest(index['clusters'], snapshot.get('DBClusterIdentifier'), {
+                'snapshot_id': snapshot['DBClusterSnapshotIdentifier'],
+                'snapshot_time': snapshot.get('SnapshotCreateTime'),
+                'snapshot_type': snapshot.get('SnapshotType', 'manual'),
+                'status': snapshot.get('Status', 'unknown')
+            })
+    
+    if include_automated_backups:
+        # Cross-region automated backups expose their latest restorable time instead of snapshots
+        for page in rds_client.get_paginator('describe_db_instance_automated_backups').paginate():
+            for backup in page.get('DBInstanceAutomatedBackups', []):
+                _index_latest(index['instances'], backup.get('DBInstanceIdentifier'), {
+                    'snapshot_id': backup.get('DBInstanceAutomatedBackupsArn', backup.get('DbiResourceId', 'N/A')),
+                    'snapshot_time': backup.get('RestoreWindow', {}).get('LatestTime'),
+                    'snapshot_type': 'automated-backup-replication',
+                    'status': backup.get('Status', 'unknown')
+                })
+    
+    return index
+
+def lookup_rds_snapshot(index, db):
+    if index is None:
+        return None
+    cluster_id = db.get('DBClusterIdentifier')
+    if cluster_id:
+        return index['clusters'].get(cluster_id)
+    return index['instances'].get(db['DBInstanceIdentifier'])
+
+def check_rds_dr(rds_client, dr_region, rpo_minutes, replica_lag_threshold, measurements=None):
     print_section_header("RDS DR Status")
     
     issues = []
     
     try:
+        dr_rds = boto3.client('rds', region_name=dr_region)
+        cloudwatch = boto3.client('cloudwatch')
+        
+        primary_index = build_rds_snapshot_index(rds_client)
+        
+        dr_index = None
+        dr_index_error = None
+        try:
+            dr_index = build_rds_snapshot_index(dr_rds, include_automated_backups=True)
+        except Exception as e:
+            dr_index_error = str(e)
+        
         db_instances = rds_client.describe_db_instances()
         
         for db in db_instances.get('DBInstances', []):
@@ -131,7 +264,6 @@ def check_rds_dr(rds_client, dr_region, rpo_minutes, replica_lag_threshold):
                         replica_id = replica_arn.split(':')[-1] if ':' in replica_arn else replica_arn
                         
                         # Check in DR region
-                        dr_rds = boto3.client('rds', region_name=dr_region)
                         replica = dr_rds.describe_db_instances(DBInstanceIdentifier=replica_id)
                         replica_info = replica['DBInstances'][0]
                         
@@ -144,7 +276,7 @@ def check_rds_dr(rds_client, dr_region, rpo_minutes, replica_lag_threshold):
                             issues.append(warning)
                         
                         try:
-                            metrics = boto3.client('cloudwatch').get_metric_statistics(
+                            metrics = cloudwatch.get_metric_statistics(
                                 Namespace='AWS/RDS',
                                 MetricName='ReplicaLag',
                                 Dimensions=[
@@ -160,6 +292,7 @@ def check_rds_dr(rds_client, dr_region, rpo_minutes, replica_lag_threshold):
                                 latest_lag = max(metrics['Datapoints'], key=lambda x: x['Timestamp'])
                                 lag_seconds = latest_lag['Average']
                                 print(f"    Replica Lag: {int(lag_seconds)} seconds")
+                                record_measurement(measurements, f"rds:{replica_id}", 'replica_lag_seconds', lag_seconds, latest_lag['Timestamp'])
                                 
                                 if lag_seconds > replica_lag_threshold:
                                     warning = f"RDS replica {replica_id} lag ({int(lag_seconds)}s) exceeds threshold ({replica_lag_threshold}s)"
@@ -178,39 +311,35 @@ def check_rds_dr(rds_client, dr_region, rpo_minutes, replica_lag_threshold):
                 print("    No read replicas configured")
                 issues.append(f"No read replicas for DB {db_id}")
             
-            snapshots = rds_client.describe_db_snapshots(DBInstanceIdentifier=db_id)
-            if snapshots['DBSnapshots']:
-                latest_snapshot = max(snapshots['DBSnapshots'], key=lambda x: x['SnapshotCreateTime'])
-                snapshot_id = latest_snapshot['DBSnapshotIdentifier']
-                snapshot_time = latest_snapshot['SnapshotCreateTime']
+            latest_snapshot = lookup_rds_snapshot(primary_index, db)
+            if latest_snapshot:
+                snapshot_id = latest_snapshot['snapshot_id']
+                snapshot_time = latest_snapshot['snapshot_time']
                 age = calculate_age(snapshot_time)
                 
                 print(f"    Latest Snapshot ID: {snapshot_id}")
+                print(f"    Snapshot Type: {latest_snapshot['snapshot_type']}")
                 print(f"    Snapshot Timestamp: {format_timestamp(snapshot_time)}")
                 
                 if age:
                     age_minutes = age.total_seconds() / 60
+                    record_measurement(measurements, f"rds:{db.get('DBClusterIdentifier') or db_id}", 'snapshot_age_minutes', age_minutes)
                     if age_minutes > rpo_minutes:
                         warning = f"RDS snapshot {snapshot_id} is older than RPO target ({rpo_minutes} minutes)"
                         print_warning(warning)
                         issues.append(warning)
                 
-                try:
-                    dr_rds = boto3.client('rds', region_name=dr_region)
-                    dr_snapshots = dr_rds.describe_db_snapshots(
-                        Filters=[
-                            {'Name': 'db-instance-id', 'Values': [db_id]}
-                        ]
-                    )
-                    
-                    if dr_snapshots['DBSnapshots']:
+                if dr_index is None:
+                    print(f"    Snapshot Copy Status: Could not verify ({dr_index_error})")
+                else:
+                    dr_snapshot = lookup_rds_snapshot(dr_index, db)
+                    if dr_snapshot:
                         print(f"    Snapshot Copy Status: Available in DR region")
+                        print(f"    DR Recovery Point: {dr_snapshot['snapshot_id']} ({format_timestamp(dr_snapshot['snapshot_time'])})")
                     else:
                         warning = f"RDS snapshot {snapshot_id} not found in DR region"
                         print_warning(warning)
                         issues.append(warning)
-                except Exception as e:
-                    print(f"    Snapshot Copy Status: Could not verify ({str(e)})")
             
             print()
     
@@ -383,7 +512,7 @@ def check_dynamodb_global_tables(dynamodb_client, dr_region):
     
     return issues
 
-def check_backup_jobs(backup_client):
+def check_backup_jobs(backup_client, measurements=None):
     print_section_header("AWS Backup Job Status")
     
     issues = []
@@ -411,6 +540,9 @@ def check_backup_jobs(backup_client):
             else:
                 print(f"    End Time: {end_time}")
             
+            if state in ('COMPLETED', 'FAILED', 'ABORTED', 'EXPIRED', 'PARTIAL'):
+                record_measurement(measurements, resource_arn, 'backup_success', 1.0 if state == 'COMPLETED' else 0.0, start_time)
+            
             if state == 'FAILED':
                 warning = f"Backup job {job_id} failed"
                 print_warning(warning)
@@ -525,16 +657,110 @@ def generate_summary(all_issues, rpo_minutes):
     
     return status
 
+def print_history_report(report, since):
+    labels = {
+        'snapshot_age_minutes': ('Snapshot Age', 'minutes'),
+        'replica_lag_seconds': ('Replica Lag', 'seconds')
+    }
+    
+    for metric, (title, unit) in labels.items():
+        section = report['metrics'].get(metric)
+        print_section_header(f"{title} Distribution Since {format_timestamp(since)}")
+        if not section:
+            print(f"  No {title.lower()} measurements recorded.")
+            continue
+        
+        overall = ', '.join(f"p{p}={section['overall'][p]:.1f}" for p in PERCENTILES)
+        print(f"  Threshold: {section['threshold']} {unit}")
+        print(f"  All Resources: {overall} {unit}\n")
+        
+        for row in section['resources']:
+            percentiles = ', '.join(f"p{p}={row['percentiles'][p]:.1f}" for p in PERCENTILES)
+            print(f"  Resource: {row['resource']}")
+            print(f"    Samples: {row['samples']}")
+            print(f"    Percentiles: {percentiles}, max={row['max']:.1f} {unit}")
+            print(f"    Trend: {row['trend_per_day']:+.2f} {unit}/day")
+            if row['breach_windows']:
+                print(f"    Breach Windows: {row['breach_windows']} "
+                      f"(total {row['breach_seconds'] / 3600:.1f}h, longest {row['longest_breach_seconds'] / 3600:.1f}h)")
+                if row['ongoing_breach']:
+                    print_warning(f"{row['resource']} is still above the {title.lower()} threshold")
+            else:
+                print(f"    Breach Windows: 0")
+            print()
+    
+    section = report['metrics'].get('backup_success')
+    print_section_header(f"Backup Success Rate Since {format_timestamp(since)}")
+    if not section:
+        print("  No backup job outcomes recorded.")
+        return
+    
+    print(f"  All Resources: {section['overall_rate'] * 100:.1f}%\n")
+    for row in section['resources']:
+        print(f"  Resource: {row['resource']}")
+        print(f"    Jobs: {row['jobs']}, Succeeded: {row['successes']} ({row['rate'] * 100:.1f}%)")
+        print()
+
+def since_argument(value):
+    try:
+        return parse_since(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid window start '{value}': use an ISO date/time or a relative age such as 12h, 30d or 8w")
+
+def run_history_report(args):
+    since = args.since
+    
+    print("=" * 60)
+    print("  AWS DR RPO/RTO HISTORY REPORT")
+    print("=" * 60)
+    print(f"\nHistory Directory: {args.history_dir}")
+    print(f"Report Window: {format_timestamp(since)} - {format_timestamp(datetime.now(timezone.utc))}")
+    
+    try:
+        history = load_history(args.history_dir)
+        report = build_report(history, since, {
+            'snapshot_age_minutes': args.rpo_minutes,
+            'replica_lag_seconds': args.replica_lag_threshold
+        })
+    except Exception as e:
+        print(f"\nFATAL ERROR: {str(e)}")
+        sys.exit(1)
+    
+    print(f"Measurements In Window: {report['rows']}")
+    print_history_report(report, since)
+    
+    print("\n" + "=" * 60)
+    print("  END OF REPORT")
+    print("=" * 60 + "\n")
+    
+    sys.exit(0)
+
 def main():
     parser = argparse.ArgumentParser(description='AWS DR Readiness Check')
     parser.add_argument('--primary-region', default=None, help='Primary AWS region')
-    parser.add_argument('--dr-region', required=True, help='DR AWS region')
+    parser.add_argument('--dr-region', default=None, help='DR AWS region (required for readiness checks)')
     parser.add_argument('--rpo-minutes', type=int, default=60, help='RPO target in minutes')
     parser.add_argument('--replica-lag-threshold', type=int, default=60, help='RDS replica lag threshold in seconds')
     parser.add_argument('--name-prefix', default='', help='Name prefix for filtering resources')
+    parser.add_argument('--copy-throughput-mibps', type=float, default=DEFAULT_THROUGHPUT_MIBPS, help='Assumed snapshot copy throughput in MiB/s when no in-flight copy can be observed')
+    parser.add_argument('--history-dir', default='dr-history', help='Directory of the local RPO/RTO metrics store')
+    parser.add_argument('--no-history', action='store_true', help='Do not append this run to the metrics store')
+    
+    subparsers = parser.add_subparsers(dest='command')
+    report_parser = subparsers.add_parser('report', help='Summarize RPO/RTO history recorded by previous runs')
+    report_parser.add_argument('--since', type=since_argument, default='30d', help='Start of the report window: ISO date/time or relative age (e.g. 12h, 30d, 8w)')
+    report_parser.add_argument('--history-dir', default=argparse.SUPPRESS, help='Directory of the local RPO/RTO metrics store')
+    report_parser.add_argument('--rpo-minutes', type=int, default=argparse.SUPPRESS, help='RPO target in minutes')
+    report_parser.add_argument('--replica-lag-threshold', type=int, default=argparse.SUPPRESS, help='RDS replica lag threshold in seconds')
     
     args = parser.parse_args()
     
+    if args.command == 'report':
+        run_history_report(args)
+    
+    if not args.dr_region:
+        parser.error('--dr-region is required')
+    
     primary_region = args.primary_region or get_primary_region()
     dr_region = args.dr_region
     rpo_minutes = args.rpo_minutes
@@ -550,6 +776,7 @@ def main():
     print(f"Replica Lag Threshold: {replica_lag_threshold} seconds")
     
     all_issues = []
+    measurements = None if args.no_history else []
     
     try:
         ec2_client = boto3.client('ec2', region_name=primary_region)
@@ -559,15 +786,23 @@ def main():
         backup_client = boto3.client('backup', region_name=primary_region)
         cloudwatch_client = boto3.client('cloudwatch', region_name=primary_region)
         
-        all_issues.extend(check_ec2_snapshots(ec2_client, dr_region, rpo_minutes))
-        all_issues.extend(check_rds_dr(rds_client, dr_region, rpo_minutes, replica_lag_threshold))
+        all_issues.extend(check_ec2_snapshots(ec2_client, dr_region, rpo_minutes, measurements))
+        all_issues.extend(check_ec2_snapshot_deltas(ec2_client, dr_region, rpo_minutes, args.copy_throughput_mibps))
+        all_issues.extend(check_rds_dr(rds_client, dr_region, rpo_minutes, replica_lag_threshold, measurements))
         all_issues.extend(check_s3_replication(s3_client, dr_region))
         all_issues.extend(check_dynamodb_global_tables(dynamodb_client, dr_region))
-        all_issues.extend(check_backup_jobs(backup_client))
+        all_issues.extend(check_backup_jobs(backup_client, measurements))
         all_issues.extend(check_cloudwatch_alarms(cloudwatch_client, name_prefix))
         
         status = generate_summary(all_issues, rpo_minutes)
         
+        if measurements is not None:
+            try:
+                recorded = append_measurements(args.history_dir, measurements)
+                print(f"\n  History: {recorded} measurements appended to {args.history_dir}")
+            except Exception as e:
+                print_warning(f"Could not record history in {args.history_dir}: {str(e)}")
+        
         print("\n" + "=" * 60)
         print("  END OF REPORT")
         print("=" * 60 + "\n")
@@ -0,0 +1,143 @@
+"""
+Failover Checkpoint Store
+Durable per-step state for failover runs, so retried or chained invocations
+resume where the previous one stopped instead of repeating actions.
+"""
+
+import json
+import os
+import time
+import boto3
+from botocore.exceptions import ClientError
+
+CHECKPOINT_TTL_SECONDS = 7 * 24 * 3600
+
+# A claim older than the failover Lambda timeout (900s) belongs to an invocation that is gone
+CLAIM_LEASE_SECONDS = 900
+
+class DynamoDBCheckpointStore:
+    def __init__(self, table_name, failover_id, owner, previous_owner=None, client=None):
+        self.table_name = table_name
+        self.failover_id = failover_id
+        self.owner = owner
+        self.previous_owner = previous_owner
+        self.client = client or boto3.client('dynamodb')
+
+    def load(self):
+        steps = {}
+        paginator = self.client.get_paginator('query')
+        pages = paginator.paginate(
+            TableName=self.table_name,
+            KeyConditionExpression='failover_id = :id',
+            ExpressionAttributeValues={':id': {'S': self.failover_id}},
+            ConsistentRead=True
+        )
+        for page in pages:
+            for item in page['Items']:
+                steps[item['step']['S']] = {
+                    'state': item['state']['S'],
+                    'message': item.get('message', {}).get('S'),
+                    'data': json.loads(item['data']['S']) if 'data' in item else None
+                }
+        return steps
+
+    def _item(self, step, state, message=None, data=None):
+        now = int(time.time())
+        item = {
+            'failover_id': {'S': self.failover_id},
+            'step': {'S': step},
+            'state': {'S': state},
+            'owner': {'S': self.owner},
+            'updated_at': {'N': str(now)},
+            'expires_at': {'N': str(now + CHECKPOINT_TTL_SECONDS)}
+        }
+        if message is not None:
+            item['message'] = {'S': message}
+        if data is not None:
+            item['data'] = {'S': json.dumps(data)}
+        return item
+
+    def claim(self, step, data=None):
+        # Idempotency key: only one invocation may start a step unless it previously failed.
+        # A step left in progress is taken over only by the invocation that owns it (a Lambda
+        # retry reuses the request ID), the chained invocation it handed off to, or once the
+        # owner's lease has expired; a concurrent duplicate delivery gets none of these.
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=self._item(step, 'in_progress', data=data),
+                ConditionExpression=(
+                    'attribute_not_exists(#step) OR #state = :failed OR '
+                    '(#state = :in_progress AND (#owner IN (:owner, :previous_owner) OR updated_at < :stale))'
+                ),
+                ExpressionAttributeNames={'#step': 'step', '#state': 'state', '#owner': 'owner'},
+                ExpressionAttributeValues={
+                    ':failed': {'S': 'failed'},
+                    ':in_progress': {'S': 'in_progress'},
+                    ':owner': {'S': self.owner},
+                    ':previous_owner': {'S': self.previous_owner or self.owner},
+                    ':stale': {'N': str(int(time.time()) - CLAIM_LEASE_SECONDS)}
+                }
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def update(self, step, state, message=None, data=None):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item=self._item(step, state, message, data)
+        )
+
+class LocalCheckpointStore:
+    def __init__(self, failover_id, owner, previous_owner=None, path=None):
+        self.failover_id = failover_id
+        self.owner = owner
+        self.previous_owner = previous_owner
+        self.path = path
+        self.runs = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.runs = json.load(f)
+
+    def _steps(self):
+        return self.runs.setdefault(self.failover_id, {})
+
+    def _save(self):
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump(self.runs, f)
+
+    def load(self):
+        return {step: dict(record) for step, record in self._steps().items()}
+
+    def claim(self, step, data=None):
+        # Same takeover rules as the DynamoDB store
+        current = self._steps().get(step)
+        if current is not None and current['state'] != 'failed':
+            taken_over = current['state'] == 'in_progress' and (
+                current.get('owner') in (self.owner, self.previous_owner)
+                or current.get('updated_at', 0) < time.time() - CLAIM_LEASE_SECONDS
+            )
+            if not taken_over:
+                return False
+        self.update(step, 'in_progress', data=data)
+        return True
+
+    def update(self, step, state, message=None, data=None):
+        self._steps()[step] = {
+            'state': state,
+            'message': message,
+            'data': data,
+            'owner': self.owner,
+            'updated_at': int(time.time())
+        }
+        self._save()
+
+def get_checkpoint_store(failover_id, owner, previous_owner=None):
+    table_name = os.environ.get('CHECKPOINT_TABLE', '')
+    if table_name:
+        return DynamoDBCheckpointStore(table_name, failover_id, owner, previous_owner)
+    return LocalCheckpointStore(failover_id, owner, previous_owner, os.environ.get('CHECKPOINT_FILE'))
@@ -1,7 +1,10 @@
 import boto3
 import json
 import os
+import time
 from datetime import datetime, timezone
+from failover_checkpoint import get_checkpoint_store
+from ec2_restore import index_dr_snapshot_copies, restore_instances
 
 ec2 = boto3.client('ec2')
 rds = boto3.client('rds')
@@ -9,77 +12,453 @@ dynamodb = boto3.client('dynamodb')
 s3 = boto3.client('s3')
 backup = boto3.client('backup')
 sns = boto3.client('sns')
+tagging = boto3.client('resourcegroupstaggingapi')
+lambda_client = boto3.client('lambda')
+
+ALL_SERVICES = ['rds', 'ec2', 'backup']
+RESTORE_SERVICE = 'ec2-restore'
+
+POLL_SECONDS = 15
+SAFETY_MARGIN_SECONDS = 60
+MAX_CHAINED_INVOCATIONS = 8
+
+def default_services():
+    if os.environ.get('EC2_RESTORE', 'false').lower() == 'true':
+        return ALL_SERVICES + [RESTORE_SERVICE]
+    return ALL_SERVICES
+
+SCOPE_KEYS = ['services', 'resource_ids', 'tags', 'application_group']
+
+def _is_string_list(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(v, str) and v for v in value)
+
+def validate_scope(scope):
+    # A malformed scope must never turn into a failover that silently does nothing
+    if not isinstance(scope, dict):
+        raise ValueError('scope must be an object')
+    unknown_keys = [key for key in scope if key not in SCOPE_KEYS]
+    if unknown_keys:
+        raise ValueError(f"unknown scope keys: {', '.join(unknown_keys)} (expected {', '.join(SCOPE_KEYS)})")
+
+    if 'services' in scope:
+        if not _is_string_list(scope['services']):
+            raise ValueError('scope.services must be a non-empty list of service names')
+        valid = ALL_SERVICES + [RESTORE_SERVICE]
+        unknown = [s for s in scope['services'] if s.lower() not in valid]
+        if unknown:
+            raise ValueError(f"unknown services in scope: {', '.join(unknown)} (expected {', '.join(valid)})")
+    if 'resource_ids' in scope and not _is_string_list(scope['resource_ids']):
+        raise ValueError('scope.resource_ids must be a non-empty list of resource IDs')
+    if 'tags' in scope:
+        tags = scope['tags']
+        if not isinstance(tags, dict) or not tags or not all(isinstance(k, str) and isinstance(v, str) for k, v in tags.items()):
+            raise ValueError('scope.tags must be a non-empty object of tag keys to values')
+    if 'application_group' in scope and not (isinstance(scope['application_group'], str) and scope['application_group']):
+        raise ValueError('scope.application_group must be a non-empty string')
+
+def parse_scope(event):
+    scope = (event or {}).get('scope')
+    if scope is None:
+        scope = {}
+    validate_scope(scope)
+
+    tags = dict(scope.get('tags') or {})
+    if scope.get('application_group'):
+        tags[os.environ.get('APPLICATION_TAG_KEY', 'Application')] = scope['application_group']
+
+    resource_ids = scope.get('resource_ids') or []
+
+    return {
+        'scoped': bool(scope),
+        'services': [s.lower() for s in scope.get('services') or default_services()],
+        'resource_ids': resource_ids,
+        'rds_ids': [r for r in resource_ids if not r.startswith('i-')],
+        'ec2_ids': [r for r in resource_ids if r.startswith('i-')],
+        'tags': tags
+    }
+
+def get_tagged_arns(resource_type, tags):
+    arns = []
+    paginator = tagging.get_paginator('get_resources')
+    pages = paginator.paginate(
+        TagFilters=[{'Key': key, 'Values': [value]} for key, value in tags.items()],
+        ResourceTypeFilters=[resource_type]
+    )
+    for page in pages:
+        arns.extend(mapping['ResourceARN'] for mapping in page['ResourceTagMappingList'])
+    return arns
+
+def get_scoped_resource_arns(scope, context):
+    # Backup jobs are looked up per resource ARN so a scoped run never reports on other resources
+    arns = []
+    if scope['tags']:
+        arns.extend(get_tagged_arns('rds:db', scope['tags']))
+        arns.extend(get_tagged_arns('ec2:instance', scope['tags']))
+    if scope['resource_ids'] and context is not None:
+        _, partition, _, region, account = context.invoked_function_arn.split(':')[:5]
+        arns.extend(f'arn:{partition}:rds:{region}:{account}:db:{r}' for r in scope['rds_ids'])
+        arns.extend(f'arn:{partition}:ec2:{region}:{account}:instance/{r}' for r in scope['ec2_ids'])
+    return list(dict.fromkeys(arns))
+
+def find_rds_replicas(scope):
+    filters = []
+    if scope['resource_ids']:
+        if not scope['rds_ids']:
+            return []
+        filters.append({'Name': 'db-instance-id', 'Values': scope['rds_ids']})
+
+    tagged_arns = None
+    if scope['tags']:
+        tagged_arns = set(get_tagged_arns('rds:db', scope['tags']))
+        if not tagged_arns:
+            return []
+        if not filters:
+            filters.append({'Name': 'db-instance-id', 'Values': sorted(tagged_arns)})
+
+    replica_ids = []
+    paginator = rds.get_paginator('describe_db_instances')
+    for page in paginator.paginate(Filters=filters):
+        for db in page['DBInstances']:
+            if tagged_arns is not None and db['DBInstanceArn'] not in tagged_arns:
+                continue
+            replica_ids.extend(db.get('ReadReplicaDBInstanceIdentifiers', []))
+            # A scope can name the replica itself rather than its primary
+            if scope['scoped'] and db.get('ReadReplicaSourceDBInstanceIdentifier'):
+                replica_ids.append(db['DBInstanceIdentifier'])
+
+    return list(dict.fromkeys(replica_ids))
+
+def find_stopped_dr_instances(scope):
+    filters = [
+        {'Name': 'tag:DR', 'Values': ['true']},
+        {'Name': 'instance-state-name', 'Values': ['stopped']}
+    ]
+    if scope['resource_ids']:
+        if not scope['ec2_ids']:
+            return []
+        filters.append({'Name': 'instance-id', 'Values': scope['ec2_ids']})
+    for key, value in scope['tags'].items():
+        filters.append({'Name': f'tag:{key}', 'Values': [value]})
+
+    instance_ids = []
+    paginator = ec2.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                instance_ids.append(instance['InstanceId'])
+    return instance_ids
+
+def describe_scope(scope):
+    if not scope['scoped']:
+        return 'all DR resources'
+    parts = [f"services={','.join(scope['services'])}"]
+    if scope['resource_ids']:
+        parts.append(f"resources={','.join(scope['resource_ids'])}")
+    if scope['tags']:
+        parts.append('tags=' + ','.join(f'{k}={v}' for k, v in scope['tags'].items()))
+    return ' '.join(parts)
+
+def get_failover_id(event, context):
+    # EventBridge event IDs and async request IDs are stable across Lambda retries
+    if event.get('failover_id'):
+        return event['failover_id']
+    if event.get('id'):
+        return event['id']
+    if context is not None:
+        return context.aws_request_id
+    return datetime.now(timezone.utc).strftime('failover-%Y%m%dT%H%M%S')
+
+def get_invocation_id(context):
+    # Lambda retries of one invocation keep its request ID, so it identifies the owner of claimed steps
+    return context.aws_request_id if context is not None else 'local'
+
+def get_deadline(context):
+    if context is None:
+        return time.monotonic() + 900 - SAFETY_MARGIN_SECONDS
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - SAFETY_MARGIN_SECONDS
+
+def notify_once(store, step, subject, message):
+    if store.claim(step):
+        try:
+            sns.publish(TopicArn=os.environ['SNS_TOPIC_ARN'], Subject=subject, Message=message)
+        except Exception as e:
+            # Leave the notification claimable so a retry sends it
+            store.update(step, 'failed', message=f'{subject}: {str(e)}')
+            raise
+        store.update(step, 'completed', message=subject)
+
+def is_promoted(replica_id):
+    replica = rds.describe_db_instances(DBInstanceIdentifier=replica_id)['DBInstances'][0]
+    return replica['DBInstanceStatus'] == 'available' and not replica.get('ReadReplicaSourceDBInstanceIdentifier')
+
+def wait_for_promotions(store, replica_ids, deadline, results):
+    pending = list(replica_ids)
+    while pending:
+        for replica_id in list(pending):
+            step = f'rds-promote:{replica_id}'
+            try:
+                if is_promoted(replica_id):
+                    message = f'Promoted RDS replica: {replica_id}'
+                    store.update(step, 'completed', message=message)
+                    results['actions_taken'].append(message)
+                    pending.remove(replica_id)
+            except Exception as e:
+                message = f'Error promoting RDS replica {replica_id}: {str(e)}'
+                store.update(step, 'failed', message=message)
+                results['errors'].append(message)
+                pending.remove(replica_id)
+
+        if not pending or time.monotonic() + POLL_SECONDS > deadline:
+            break
+        time.sleep(POLL_SECONDS)
+
+    return pending
+
+def get_restore_instance_ids(scope):
+    # Copies only carry the source instance ID, so tag scopes are resolved to instance IDs first
+    instance_ids = scope['ec2_ids'] if scope['resource_ids'] else None
+    if scope['tags']:
+        tagged_ids = [arn.split('/')[-1] for arn in get_tagged_arns('ec2:instance', scope['tags'])]
+        instance_ids = [i for i in instance_ids if i in tagged_ids] if instance_ids is not None else tagged_ids
+    return instance_ids
+
+def restore_from_dr_snapshots(store, checkpoints, scope, failover_id, dr_region, rto_target, deadline, results):
+    instance_ids = get_restore_instance_ids(scope)
+    if instance_ids is not None and not instance_ids:
+        results['actions_taken'].append(f'EC2 restore skipped: no EC2 instances match {describe_scope(scope)}')
+        return []
+
+    dr_ec2 = boto3.client('ec2', region_name=dr_region)
+    copies_by_instance = index_dr_snapshot_copies(dr_ec2, instance_ids)
+    if instance_ids:
+        missing = sorted(set(instance_ids) - set(copies_by_instance))
+        if missing:
+            results['actions_taken'].append(f'EC2 restore skipped for instances without DR snapshot copies: {", ".join(missing)}')
+
+    to_restore = {}
+    started_at = {}
+    for source_instance_id, copies in copies_by_instance.items():
+        step = f'ec2-restore:{source_instance_id}'
+        checkpoint = checkpoints.get(step, {})
+        # The first claim records the restore start so RTO covers every chained invocation
+        started = (checkpoint.get('data') or {}).get('started_at') or time.time()
+        # A restore taken over from an interrupted owner is rerun safely: image names and client tokens make it idempotent
+        if checkpoint.get('state') == 'completed' or not store.claim(step, data={'started_at': started}):
+            results['resumed_steps'].append(step)
+            continue
+        to_restore[source_instance_id] = copies
+        started_at[source_instance_id] = started
+
+    results['ec2_restore'] = restore_instances(
+        dr_ec2,
+        failover_id,
+        to_restore,
+        started_at,
+        os.environ.get('DR_SUBNET_ID', ''),
+        [sg for sg in os.environ.get('DR_SECURITY_GROUP_IDS', '').split(',') if sg],
+        rto_target * 60,
+        deadline
+    )
+
+    pending = []
+    for restore in results['ec2_restore']:
+        step = f"ec2-restore:{restore['source_instance_id']}"
+        restored = restore.get('restored_instance_id') or ', '.join(restore.get('restored_volume_ids', []))
+        if restore['status'] == 'completed':
+            message = f"Restored EC2 instance {restore['source_instance_id']} in {dr_region} as {restored} ({restore['restore_seconds']}s)"
+            store.update(step, 'completed', message=message, data=restore)
+            results['actions_taken'].append(message)
+            if not restore['within_rto']:
+                results.setdefault('rto_breaches', []).append(
+                    f"Restore of {restore['source_instance_id']} took {restore['restore_seconds']}s, over the RTO target ({rto_target} minutes)"
+                )
+        elif restore['status'] == 'pending':
+            pending.append(restore['source_instance_id'])
+        else:
+            message = f"Error restoring EC2 instance {restore['source_instance_id']}: {restore.get('error')}"
+            store.update(step, 'failed', message=message, data=restore)
+            results['errors'].append(message)
+
+    return pending
+
+def continue_in_new_invocation(event, context, failover_id):
+    hop = event.get('checkpoint_hop', 0) + 1
+    if context is None or hop > MAX_CHAINED_INVOCATIONS:
+        return False
+    # The next hop may take over the steps this invocation still holds
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(dict(event, failover_id=failover_id, checkpoint_hop=hop, previous_owner=context.aws_request_id))
+    )
+    return True
 
 def handler(event, context):
     dr_region = os.environ['DR_REGION']
     sns_topic_arn = os.environ['SNS_TOPIC_ARN']
     rto_target = int(os.environ['RTO_TARGET'])
-    
+    event = event or {}
+    failover_id = get_failover_id(event, context)
+    deadline = get_deadline(context)
+
+    try:
+        scope = parse_scope(event)
+    except ValueError as e:
+        message = f'DR failover process {failover_id} rejected: invalid scope: {str(e)}'
+        sns.publish(TopicArn=sns_topic_arn, Subject='DR Failover Rejected', Message=message)
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'failover_id': failover_id, 'status': 'rejected', 'errors': [message]})
+        }
+
     results = {
+        'failover_id': failover_id,
         'timestamp': datetime.now(timezone.utc).isoformat(),
+        'scope': describe_scope(scope),
+        'status': 'completed',
         'actions_taken': [],
+        'resumed_steps': [],
         'errors': []
     }
-    
+
     try:
-        sns.publish(
-            TopicArn=sns_topic_arn,
-            Subject='DR Failover Initiated',
-            Message=f'DR failover process started at {results["timestamp"]}'
-        )
-        
-        rds_instances = rds.describe_db_instances()
-        for db in rds_instances['DBInstances']:
-            if db.get('ReadReplicaDBInstanceIdentifiers'):
-                for replica_id in db['ReadReplicaDBInstanceIdentifiers']:
-                    try:
-                        replica = rds.describe_db_instances(DBInstanceIdentifier=replica_id)
-                        if replica['DBInstances'][0]['DBInstanceStatus'] == 'available':
-                            rds.promote_read_replica(DBInstanceIdentifier=replica_id)
-                            results['actions_taken'].append(f'Promoted RDS replica: {replica_id}')
-                    except Exception as e:
-                        results['errors'].append(f'Error promoting RDS replica {replica_id}: {str(e)}')
-        
-        ec2_instances = ec2.describe_instances(
-            Filters=[
-                {'Name': 'tag:DR', 'Values': ['true']},
-                {'Name': 'instance-state-name', 'Values': ['stopped']}
-            ]
-        )
-        
-        for reservation in ec2_instances['Reservations']:
-            for instance in reservation['Instances']:
-                try:
-                    ec2.start_instances(InstanceIds=[instance['InstanceId']])
-                    results['actions_taken'].append(f'Started EC2 instance: {instance["InstanceId"]}')
-                except Exception as e:
-                    results['errors'].append(f'Error starting EC2 instance {instance["InstanceId"]}: {str(e)}')
-        
-        backup_jobs = backup.list_backup_jobs(
-            ByState='COMPLETED',
-            MaxResults=10
+        store = get_checkpoint_store(failover_id, get_invocation_id(context), event.get('previous_owner'))
+        checkpoints = store.load()
+
+        notify_once(
+            store, 'notify-start', 'DR Failover Initiated',
+            f'DR failover process {failover_id} started at {results["timestamp"]} for {results["scope"]}'
         )
-        
-        if backup_jobs['BackupJobs']:
-            latest_backup = backup_jobs['BackupJobs'][0]
-            results['actions_taken'].append(f'Latest backup available: {latest_backup["BackupJobId"]}')
-        
-        sns.publish(
-            TopicArn=sns_topic_arn,
-            Subject='DR Failover Completed',
-            Message=f'DR failover process completed. Actions: {len(results["actions_taken"])}, Errors: {len(results["errors"])}'
+
+        discovery = checkpoints.get('discovery')
+        if discovery and discovery['state'] == 'completed':
+            plan = discovery['data']
+            results['resumed_steps'].append('discovery')
+        else:
+            plan = {
+                'rds_replicas': find_rds_replicas(scope) if 'rds' in scope['services'] else [],
+                'ec2_instances': find_stopped_dr_instances(scope) if 'ec2' in scope['services'] else []
+            }
+            store.update('discovery', 'completed', data=plan)
+
+        promoting = []
+        for replica_id in plan['rds_replicas']:
+            step = f'rds-promote:{replica_id}'
+            state = checkpoints.get(step, {}).get('state')
+            if state == 'promoting':
+                # Promotion was already requested; only the wait needs to resume
+                promoting.append(replica_id)
+                results['resumed_steps'].append(step)
+                continue
+            if state in ('completed', 'skipped') or not store.claim(step):
+                results['resumed_steps'].append(step)
+                continue
+            interrupted = state == 'in_progress'
+            try:
+                replica = rds.describe_db_instances(DBInstanceIdentifier=replica_id)['DBInstances'][0]
+                if replica['DBInstanceStatus'] == 'available' and replica.get('ReadReplicaSourceDBInstanceIdentifier'):
+                    rds.promote_read_replica(DBInstanceIdentifier=replica_id)
+                    store.update(step, 'promoting')
+                    promoting.append(replica_id)
+                elif interrupted:
+                    # The previous invocation stopped after requesting promotion but before recording it
+                    promoting.append(replica_id)
+                    results['resumed_steps'].append(step)
+                else:
+                    store.update(step, 'skipped', message=f'RDS replica {replica_id} not available')
+            except Exception as e:
+                message = f'Error promoting RDS replica {replica_id}: {str(e)}'
+                store.update(step, 'failed', message=message)
+                results['errors'].append(message)
+
+        for instance_id in plan['ec2_instances']:
+            step = f'ec2-start:{instance_id}'
+            state = checkpoints.get(step, {}).get('state')
+            # StartInstances is idempotent, so a start taken over from an interrupted owner is simply reissued
+            if state == 'completed' or not store.claim(step):
+                results['resumed_steps'].append(step)
+                continue
+            try:
+                ec2.start_instances(InstanceIds=[instance_id])
+                message = f'Started EC2 instance: {instance_id}'
+                store.update(step, 'completed', message=message)
+                results['actions_taken'].append(message)
+            except Exception as e:
+                message = f'Error starting EC2 instance {instance_id}: {str(e)}'
+                store.update(step, 'failed', message=message)
+                results['errors'].append(message)
+
+        pending_restores = []
+        if RESTORE_SERVICE in scope['services']:
+            pending_restores = restore_from_dr_snapshots(store, checkpoints, scope, failover_id, dr_region, rto_target, deadline, results)
+
+        # Only a scope that names resources narrows the backup check; a services-only scope covers the estate
+        if 'backup' in scope['services'] and not scope['resource_ids'] and not scope['tags']:
+            backup_jobs = backup.list_backup_jobs(
+                ByState='COMPLETED',
+                MaxResults=10
+            )
+
+            if backup_jobs['BackupJobs']:
+                latest_backup = backup_jobs['BackupJobs'][0]
+                results['actions_taken'].append(f'Latest backup available: {latest_backup["BackupJobId"]}')
+        elif 'backup' in scope['services']:
+            resource_arns = get_scoped_resource_arns(scope, context)
+            if not resource_arns:
+                results['actions_taken'].append('Backup check skipped: no resources in scope')
+            for resource_arn in resource_arns:
+                backup_jobs = backup.list_backup_jobs(
+                    ByResourceArn=resource_arn,
+                    ByState='COMPLETED',
+                    MaxResults=10
+                )
+
+                if backup_jobs['BackupJobs']:
+                    latest_backup = backup_jobs['BackupJobs'][0]
+                    results['actions_taken'].append(f'Latest backup available for {resource_arn}: {latest_backup["BackupJobId"]}')
+
+        pending = wait_for_promotions(store, promoting, deadline, results) + pending_restores
+        if pending:
+            results['status'] = 'in_progress'
+            if continue_in_new_invocation(event, context, failover_id):
+                results['actions_taken'].append(f'Continuing in a new invocation; waiting on: {", ".join(pending)}')
+            else:
+                results['errors'].append(f'Timed out waiting for: {", ".join(pending)}')
+            return {
+                'statusCode': 202 if not results['errors'] else 500,
+                'body': json.dumps(results)
+            }
+
+        steps = {step: record for step, record in store.load().items() if step.startswith(('rds-promote:', 'ec2-start:', 'ec2-restore:'))}
+        # Steps still open here are held by a concurrent delivery of the same event, which reports completion itself
+        held = sorted(step for step, record in steps.items() if record['state'] in ('in_progress', 'promoting'))
+        if held:
+            results['status'] = 'in_progress'
+            results['actions_taken'].append(f'Steps held by another invocation: {", ".join(held)}')
+            return {
+                'statusCode': 202,
+                'body': json.dumps(results)
+            }
+
+        steps = steps.values()
+        completed = sum(1 for record in steps if record['state'] == 'completed')
+        failed = sum(1 for record in steps if record['state'] == 'failed')
+
+        notify_once(
+            store, 'notify-complete', 'DR Failover Completed',
+            f'DR failover process {failover_id} completed for {results["scope"]}. Actions: {completed}, Errors: {failed}'
         )
-        
+
     except Exception as e:
+        results['status'] = 'failed'
         results['errors'].append(f'Critical error in failover process: {str(e)}')
         sns.publish(
             TopicArn=sns_topic_arn,
             Subject='DR Failover Failed',
-            Message=f'DR failover process failed: {str(e)}'
+            Message=f'DR failover process {failover_id} failed: {str(e)}'
         )
-    
+
     return {
         'statusCode': 200 if not results['errors'] else 500,
         'body': json.dumps(results)
     }
-
@@ -144,6 +144,36 @@ variable "ec2_instance_ids" {
   default     = []
 }
 
+variable "ec2_change_detection" {
+  description = "Skip EC2 DR snapshots of volumes with no writes since their last DR snapshot"
+  type        = bool
+  default     = false
+}
+
+variable "ec2_max_snapshot_interval" {
+  description = "Maximum minutes between EC2 DR snapshots of an idle volume"
+  type        = number
+  default     = 1440
+}
+
+variable "ec2_delta_sizing" {
+  description = "Report changed bytes and predicted copy time for each EC2 DR snapshot"
+  type        = bool
+  default     = false
+}
+
+variable "ec2_restore_on_failover" {
+  description = "Rebuild protected EC2 instances from DR-region snapshot copies during failover"
+  type        = bool
+  default     = false
+}
+
+variable "ec2_snapshot_shard_size" {
+  description = "Instances per EC2 snapshot worker; 0 disables sharded fan-out"
+  type        = number
+  default     = 0
+}
+
 variable "rds_instance_id" {
   description = "RDS instance identifier"
   type        = string